@@ -3,19 +3,50 @@ import json
 from requests.auth import HTTPBasicAuth
 from flask import Flask
 from flask_restful import Resource, Api
-from node_api import requires_auth
+from flask import request, jsonify
+from node_api import requires_auth, get_ip
 from placementCycle.placement import check_alive, start_placement, millis
-from invocationPathCycle.invocation import self_adapt
+from invocationPathCycle.invocation import self_adapt, create_invocation_engine, find_invocation_path, \
+    stop_invocation_engine, start_backup_paths, backup_invocation_path, update_engine_latencies, build_latency_store, \
+    start_engine_refresh, stop_engine_refresh, ENGINE_REFRESH_INTERVAL
 from typing import List
-from multiprocessing import Process, Pool, Event, Manager
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+from requests.adapters import HTTPAdapter
 import time
 import docker
-from monitoring import start_monitoring, monitoring_results
+from monitoring import start_monitoring, monitoring_results, start_latency_monitoring, cached_latency_store, \
+    LATENCY_STALENESS, MONITORING_INTERVAL, MONITORING_SUSPICION, record_heartbeat, start_heartbeat_monitoring, \
+    heartbeat_resources, HEARTBEAT_INTERVAL, HEARTBEAT_MISSES, wait_for_events
+from threading import Thread, Semaphore
 import argparse
+import codec
 
 app = Flask(__name__)
 api = Api(app)
+# the number of seconds the node status changes are batched into one adaptation
+ADAPTATION_WINDOW = 0.5
+# the number of containers started at the same time on a node and on all nodes
+NODE_DEPLOYMENTS = 2
+DEPLOY_WORKERS = 32
+# how the nodes forward the messages of the application, see the /forwarding_mode endpoint of node_api
+forwarding_config = {'mode': 'sync', 'workers': 1, 'batch_size': 1, 'batch_window': 5, 'codec': codec.JSON,
+                     'balancing': 'path'}
+# the connections to the nodes are shared by every deployment
+deploy_session = requests.Session()
+deploy_session.mount('http://', HTTPAdapter(pool_maxsize=DEPLOY_WORKERS))
+
+
+@app.route('/heartbeat', methods=['POST'])
+@requires_auth
+def heartbeat():
+    """Receive the heartbeat of a node, the node is asked to resync its resources when a heartbeat was lost"""
+    return jsonify({'resync': record_heartbeat(request.get_json())})
+
+
+def start_coordinator(port):
+    """Serve the heartbeat endpoint of the coordinator in a background thread"""
+    Thread(target=app.run, kwargs={'host': '0.0.0.0', 'port': port, 'threaded': True}, daemon=True).start()
 
 
 def find_topology(file_name):
@@ -95,32 +126,115 @@ def update_placement_solution(solution, failed_nodes_ids):
     return solution
 
 
-def start_container(nodes_ip, info, credentials, node):
+def start_container(nodes_ip, info, credentials, node, node_limit):
+    """
+    Start a container on a node once the node has a free deployment slot
+    :param node_limit: the semaphore bounding the concurrent deployments on the node
+    :return: a dictionary with the microservice, the node, the deployment latency in ms, the start latency in ms
+    measured by the node, whether a warm container was started and the error if any
+    """
+    result = {'microservice': info[0], 'node': node, 'latency': None, 'start_latency': None, 'warm': False,
+              'error': None}
+    with node_limit:
+        start_time = millis()
+        try:
+            resp = deploy_session.post(nodes_ip[node] + '/start_docker_container', json=info, auth=credentials,
+                                       timeout=1000)
+            resp.raise_for_status()
+            if resp.headers.get('Content-Type') == 'application/json':
+                started = resp.json()
+                result['start_latency'] = started['latency']
+                result['warm'] = started['warm']
+        except requests.exceptions.RequestException as e:
+            result['error'] = str(e)
+        result['latency'] = millis() - start_time
+    return result
+
+
+def start_all_containers(solution, microservices_ports, credentials, nodes_ip, node_deployments=NODE_DEPLOYMENTS):
+    """
+    Start all containers on their host at once, at most node_deployments containers are started at the same time on
+    a node
+    :return: a list with the result of every container, see start_container
+    """
+    node_limits = {node: Semaphore(node_deployments) for nodes in solution.values() for node in nodes}
+    replicas = [(microservice, node) for microservice, nodes in solution.items() for node in nodes]
+    with ThreadPoolExecutor(max_workers=min(DEPLOY_WORKERS, len(replicas)) or 1) as executor:
+        futures = []
+        for microservice, node in replicas:
+            c_port, e_port = microservices_ports[microservice]
+            info = [microservice, c_port, e_port]
+            futures.append(executor.submit(start_container, nodes_ip, info, credentials, node, node_limits[node]))
+        results = [future.result() for future in futures]
+
+    for result in results:
+        if result['error']:
+            print(f'Failed to start {result["microservice"]} on node {result["node"]}: {result["error"]}')
+        else:
+            print(f'Started {result["microservice"]} on node {result["node"]} in {result["latency"]} ms '
+                  f'(container start = {result["start_latency"]} ms, warm = {result["warm"]})')
+    return results
+
+
+def prefetch_images(nodes_ip, images, credentials, warm_pool=0):
+    """
+    Pull the images of the microservices on every node ahead of their deployment
+    :param nodes_ip: a dictionary having as key the node id and as value its IP
+    :param images: the images of the microservices
+    :param warm_pool: the number of stopped containers every node keeps for every image
+    """
+    def prefetch(node_ip):
+        try:
+            resp = deploy_session.post(f'{node_ip}/prefetch_images', params={'warm': warm_pool}, json=images,
+                                       auth=credentials, timeout=1000)
+            print(f'Node {node_ip} pulled the images in {resp.json()} ms')
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f'Node {node_ip} could not prefetch the images: {e}')
 
-    resp = requests.post(nodes_ip[node] + '/start_docker_container', json=info, auth=credentials,
-                         timeout=1000)
-    return resp
+    with ThreadPoolExecutor(max_workers=min(DEPLOY_WORKERS, len(nodes_ip)) or 1) as executor:
+        list(executor.map(prefetch, nodes_ip.values()))
 
 
-def start_all_containers(solution, microservices_ports, credentials, nodes_ip):
-    """Start all containers on their host"""
-    for microservice, nodes in solution.items():
-        c_port, e_port = microservices_ports[microservice]
-        info = [microservice, c_port, e_port]
-        pool = Pool(processes=len(nodes))
-        func = partial(start_container, nodes_ip, info, credentials)
-        results = pool.map(func, nodes)
+def send_knowledge(node_ip, invocation_path, microservices_ports, microservices_dest, nodes_ip, credentials,
+                   solution=None):
+    """
+    Send to a node everything it needs to forward the messages of the application
+    :param solution: the placement solution, the node balances the messages between the replicas when it is given
+    """
+    content_type = forwarding_config['codec']
+    knowledge_items = [('microservices_dest', microservices_dest), ('microservices_ports', microservices_ports),
+                       ('invocation_path', invocation_path), ('nodes_ips', nodes_ip),
+                       ('forwarding_mode', forwarding_config)]
+    if solution is not None:
+        knowledge_items.append(('replicas', solution))
+    for endpoint, knowledge in knowledge_items:
+        # a node that does not support the codec answers 415 once, it gets the next messages in JSON
+        _, content_type = codec.post(deploy_session, f'{node_ip}/{endpoint}', knowledge, content_type,
+                                     auth=credentials, timeout=20)
+
+
+def start_new_replicas(new_solution, solution, microservices_ports, credentials, nodes_ip,
+                       node_deployments=NODE_DEPLOYMENTS):
+    """
+    Start only the replicas of a new placement solution that the current solution does not run
+    :param new_solution: the placement solution found after a node rejoined
+    :param solution: the current placement solution
+    :param node_deployments: the maximum number of containers started at the same time on a node
+    :return: a list with the result of every started container, see start_container
+    """
+    new_replicas = {m: [n for n in nodes if n not in solution.get(m, [])] for m, nodes in new_solution.items()}
+    return start_all_containers({m: nodes for m, nodes in new_replicas.items() if nodes}, microservices_ports,
+                                credentials, nodes_ip, node_deployments)
 
 
-def start_application(invocation_path, microservices_ports, microservices_dest, nodes_ip, credentials, failed_node):
+def start_application(invocation_path, microservices_ports, microservices_dest, nodes_ip, credentials, failed_node,
+                      solution=None):
     """Start the application and get the results"""
     print(f'Send the required knowledge to nodes')
     for node_id, node_ip in nodes_ip.items():
         if failed_node != node_id:
-            resp1 = requests.post(f'{node_ip}/microservices_dest', json=microservices_dest, auth=credentials, timeout=20)
-            resp2 = requests.post(f'{node_ip}/microservices_ports', json=microservices_ports, auth=credentials, timeout=20)
-            resp3 = requests.post(f'{node_ip}/invocation_path', json=invocation_path, auth=credentials, timeout=20)
-            resp4 = requests.post(f'{node_ip}/nodes_ips', json=nodes_ip, auth=credentials, timeout=20)
+            send_knowledge(node_ip, invocation_path, microservices_ports, microservices_dest, nodes_ip, credentials,
+                           solution)
 
     print(f'Starting the application....')
     node = invocation_path['cosminava/m1']
@@ -137,26 +251,26 @@ def start_application(invocation_path, microservices_ports, microservices_dest,
     return m4_res.json()
 
 
-def check_nodes():
-    """
-    Check if any of the monitored nodes has failed
-    :return: a list of nodes that failed
-    """
-    failed_nodes = []
-    for node, status in monitoring_results.items():
-        if status == 'down':
-            failed_nodes.append(node)
-    return failed_nodes
-
-
-def update_monitoring_list(failed_nodes):
+def push_invocation_path(invocation_path, nodes_ip, credentials, failed_nodes, solution=None):
     """
-    Stop monitoring any node that has failed.
-    :param failed_nodes: a list of failed nodes.
+    Send the new invocation path to every node that is still available
+    :param invocation_path: the invocation path found after the failure
+    :param nodes_ip: a dictionary having as key the node id and as value its IP
+    :param credentials: the credentials used to query the nodes
+    :param failed_nodes: the ids of the failed nodes
+    :param solution: the placement solution without the failed nodes, sent when the nodes balance the messages
     """
-    for node in failed_nodes:
-        del monitoring_results[node]
-    print(f'Updated monitoring nodes dict: {monitoring_results}')
+    for node_id, node_ip in nodes_ip.items():
+        if node_id not in failed_nodes:
+            # a node that cannot be reached now is detected by the monitoring, the other nodes are still updated
+            try:
+                codec.post(deploy_session, f'{node_ip}/invocation_path', invocation_path, forwarding_config['codec'],
+                           auth=credentials, timeout=20)
+                if solution is not None:
+                    codec.post(deploy_session, f'{node_ip}/replicas', solution, forwarding_config['codec'],
+                               auth=credentials, timeout=20)
+            except requests.exceptions.RequestException as e:
+                print(f'The invocation path could not be sent to node {node_id}: {e}')
 
 
 def parse_args():
@@ -172,7 +286,74 @@ def parse_args():
     parser.add_argument('-e', '--edge_nodes', type=str, help='Give the name of the file containing the list of '
                                                              'edge nodes.',
                         required=True)
+    parser.add_argument('--incremental', action='store_true',
+                        help='Reuse a single solver per microservice while searching for its replicas.')
+    parser.add_argument('--fast-path', action='store_true',
+                        help='Compute the number of replicas directly and only check the mapping with the solver.')
+    parser.add_argument('--joint', action='store_true',
+                        help='Place all microservices with a single formula minimizing the total replicas.')
+    parser.add_argument('--encoding', type=str, default='int', choices=['int', 'pb'],
+                        help='Map the replicas with integer symbols or with a pseudo-boolean symbol per node.')
+    parser.add_argument('--report-size', action='store_true',
+                        help='Report the formula size of every microservice placed one at a time.')
+    parser.add_argument('--cache-file', type=str, default=None,
+                        help='Cache the placement solutions in this file and reuse them while they remain valid.')
+    parser.add_argument('--cache-size', type=int, default=32, help='The maximum number of cached placement solutions.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='The number of processes placing the microservices in parallel, 0 uses every core.')
+    parser.add_argument('--warm-start', action='store_true',
+                        help='Keep the invocation path solver alive and only exclude the failed nodes on recovery.')
+    parser.add_argument('--backup-paths', action='store_true',
+                        help='Precompute in the background an invocation path for every single node failure, '
+                             'implies --warm-start.')
+    parser.add_argument('--backup-pairs', action='store_true',
+                        help='Precompute the backup invocation paths for every pair of failed nodes as well.')
+    parser.add_argument('--latency-monitor', action='store_true',
+                        help='Measure the latencies in the background and reuse them when adapting.')
+    parser.add_argument('--staleness', type=int, default=LATENCY_STALENESS,
+                        help='The number of seconds after which a cached latency is measured again.')
+    parser.add_argument('--monitor-interval', type=float, default=MONITORING_INTERVAL,
+                        help='The number of seconds between two probes of a node.')
+    parser.add_argument('--suspicion', type=int, nargs=2, default=MONITORING_SUSPICION, metavar=('K', 'N'),
+                        help='A node is considered failed when K of its last N probes failed.')
+    parser.add_argument('--heartbeat-port', type=int, default=None,
+                        help='Let the nodes push heartbeats to this port of the coordinator instead of probing them.')
+    parser.add_argument('--heartbeat-interval', type=float, default=HEARTBEAT_INTERVAL,
+                        help='The number of seconds between two heartbeats of a node.')
+    parser.add_argument('--heartbeat-misses', type=int, default=HEARTBEAT_MISSES,
+                        help='The number of missed heartbeats after which a node is considered failed.')
+    parser.add_argument('--coordinator-ip', type=str, default=None,
+                        help='The IP address the nodes use to reach the coordinator, detected by default.')
+    parser.add_argument('--event-window', type=float, default=ADAPTATION_WINDOW,
+                        help='The number of seconds the node status changes are batched into one adaptation.')
+    parser.add_argument('--node-deployments', type=int, default=NODE_DEPLOYMENTS,
+                        help='The number of containers started at the same time on a node.')
+    parser.add_argument('--prefetch', action='store_true',
+                        help='Pull the images of all microservices on every node while the placement is solved.')
+    parser.add_argument('--warm-pool', type=int, default=0,
+                        help='The number of stopped containers every node keeps for every prefetched image, '
+                             'implies --prefetch.')
+    parser.add_argument('--async-forwarding', action='store_true',
+                        help='The nodes acknowledge every message at once and forward it from a bounded queue.')
+    parser.add_argument('--forward-workers', type=int, default=1,
+                        help='The number of threads forwarding the queued messages on every node, a single thread '
+                             'keeps the order of the messages.')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='The number of messages to the same microservice sent as one request, 1 disables the '
+                             'batching.')
+    parser.add_argument('--batch-window', type=float, default=5,
+                        help='The number of ms a message waits for its batch to fill.')
+    parser.add_argument('--codec', type=str, default='json', choices=['json', 'msgpack', 'cbor'],
+                        help='The encoding of the messages sent to and between the nodes, the nodes that do not '
+                             'support it fall back to JSON.')
+    parser.add_argument('--balancing', type=str, default='path', choices=['path', 'p2c', 'least-latency'],
+                        help='Follow the invocation path, or balance the messages between the live replicas with the '
+                             'power of two choices or the least measured latency.')
     args = parser.parse_args()
+    if args.encoding == 'pb' and (args.fast_path or args.incremental):
+        parser.error('--encoding pb has its own replica search, it cannot be combined with --fast-path or '
+                     '--incremental')
+    args.warm_start = args.warm_start or args.backup_paths
 
     return args
 
@@ -190,44 +371,158 @@ def main():
     app, microservice_ports = get_application(f'{app_file}.json')
     microservices_dest = find_microservice_destinations(app)
 
+    if args.prefetch or args.warm_pool:
+        print(f'Start prefetching the images...')
+        Thread(target=prefetch_images, args=(nodes_to_ips, list(microservice_ports), credentials, args.warm_pool),
+               daemon=True).start()
+
     print(f'Start node monitoring...')
-    start_monitoring(nodes_to_ips)
+    heartbeats = None
+    if args.heartbeat_port:
+        start_coordinator(args.heartbeat_port)
+        coordinator_url = f'http://{args.coordinator_ip or get_ip()}:{args.heartbeat_port}/heartbeat'
+        start_heartbeat_monitoring(nodes_to_ips, credentials, coordinator_url, args.heartbeat_interval,
+                                   args.heartbeat_misses)
+        # the first heartbeats carry the resources read by the placement
+        time.sleep(args.heartbeat_interval)
+        heartbeats = heartbeat_resources()
+    else:
+        start_monitoring(nodes_to_ips, interval=args.monitor_interval, suspicion=args.suspicion)
+    latency_monitor = None
+    if args.latency_monitor:
+        print(f'Start latency monitoring...')
+        latency_monitor = start_latency_monitoring(topology, credentials)
     print(f'Start application placement...')
-    solution = start_placement(topology, credentials, app)
+    solution = start_placement(topology, credentials, app, incremental=args.incremental,
+                               fast_path=args.fast_path, joint=args.joint, encoding=args.encoding,
+                               cache_file=args.cache_file, cache_size=args.cache_size, workers=args.workers,
+                               heartbeats=heartbeats, report_size=args.report_size)
     print(f'The found solution is {solution}')
 
     print(f'Start all containers!')
     start_time_start = int(round(time.time() * 1000))
-    start_all_containers(solution, microservice_ports, credentials, nodes_to_ips)
+    deployment = start_all_containers(solution, microservice_ports, credentials, nodes_to_ips,
+                                      args.node_deployments)
+    failed_containers = [result for result in deployment if result['error']]
+    if failed_containers:
+        print(f'{len(failed_containers)} of {len(deployment)} containers failed to start!')
     print(f'All containers are functional! required time = {int(round(time.time() * 1000)) - start_time_start}')
     print(f'Starting to find a first invocation path...')
-    invocation_path = self_adapt(solution, topology, app, credentials)
+    latency_store = cached_latency_store(latency_monitor, credentials, args.staleness) if latency_monitor else None
+    if args.warm_start:
+        engine = create_invocation_engine(solution, topology, app, credentials, latency_store)
+        invocation_path = find_invocation_path(engine)
+        if args.backup_paths:
+            start_backup_paths(engine, args.backup_pairs)
+        # between two failures the engine follows the latencies, without the monitor they are all measured again
+        if latency_monitor:
+            engine_refresh = start_engine_refresh(engine, partial(cached_latency_store, latency_monitor, credentials,
+                                                                  args.staleness),
+                                                  ENGINE_REFRESH_INTERVAL, args.backup_pairs, args.backup_paths)
+        else:
+            engine_refresh = start_engine_refresh(engine, partial(build_latency_store, topology, credentials),
+                                                  args.staleness, args.backup_pairs, args.backup_paths)
+    else:
+        invocation_path = self_adapt(solution, topology, app, credentials, latency_store=latency_store)
     print(f'Done. The invocation path is: {invocation_path}')
 
     print(f'Start the application according to the invocation path')
-
-    result = start_application(invocation_path, microservice_ports, microservices_dest, nodes_to_ips, credentials, "")
+    forwarding_config.update(mode='async' if args.async_forwarding else 'sync', workers=args.forward_workers,
+                             batch_size=args.batch_size, batch_window=args.batch_window,
+                             # a codec that is not installed here falls back to JSON
+                             codec=codec.negotiate(', '.join(codec.available_codecs()),
+                                                   {'json': codec.JSON, 'msgpack': codec.MSGPACK,
+                                                    'cbor': codec.CBOR}[args.codec]),
+                             balancing=args.balancing)
+    # the replicas are only pushed when the nodes balance the messages between them
+    balanced = args.balancing != 'path'
+
+    result = start_application(invocation_path, microservice_ports, microservices_dest, nodes_to_ips, credentials, "",
+                               solution if balanced else None)
     print(f'App has finished, the result is: {result}')
     print(f'Starting the monitoring process...')
 
+    failed_ids = set()
+    failed_topology = {}
     while invocation_path:
-        failed_nodes = check_nodes()
+        events = wait_for_events(args.event_window)
+        failed_nodes = [n for n, status in events.items() if status == 'down' and
+                        any(node['ip'] == n for node in topology)]
+        recovered_nodes = [n for n, status in events.items() if status == 'up' and n in failed_topology]
+        if not failed_nodes and not recovered_nodes:
+            continue
+        adaptation_time = millis()
+        print(f'Checking node status: {monitoring_results}')
         if failed_nodes:
-            print(f'Checking node status: {monitoring_results}')
             print(f'Some nodes failed: {failed_nodes}')
+            failed_topology.update({node['ip']: node for node in topology if node['ip'] in failed_nodes})
             topology, failed_node_ids = update_topology_after_failure(failed_nodes, topology)
             solution = update_placement_solution(solution, failed_node_ids)
             print(f'Solution after node failed: {solution}')
             print(f'Topology after node failure: {topology}')
-            update_monitoring_list(failed_nodes)
-            print(f'Checking node status: {monitoring_results}')
+            failed_ids.update(failed_node_ids.values())
+        if recovered_nodes:
+            print(f'Some nodes rejoined: {recovered_nodes}')
+            for node_ip in recovered_nodes:
+                node = failed_topology.pop(node_ip)
+                topology.append(node)
+                failed_ids.discard(node['id'])
+            print(f'Start finding a new placement strategy!')
+            if args.heartbeat_port:
+                heartbeats = heartbeat_resources()
+            new_solution = start_placement(topology, credentials, app, incremental=args.incremental,
+                                           fast_path=args.fast_path, joint=args.joint, encoding=args.encoding,
+                                           cache_file=args.cache_file, cache_size=args.cache_size,
+                                           workers=args.workers, heartbeats=heartbeats,
+                                           report_size=args.report_size)
+            start_new_replicas(new_solution, solution, microservice_ports, credentials, nodes_to_ips,
+                               args.node_deployments)
+            solution = new_solution
+            print(f'The new solution is {solution}')
+            if latency_monitor:
+                latency_store = cached_latency_store(latency_monitor, credentials, args.staleness)
+            if args.warm_start:
+                stop_invocation_engine(engine)
+                engine = create_invocation_engine(solution, topology, app, credentials, latency_store)
+                engine_refresh['engine'] = engine
+                invocation_path = find_invocation_path(engine)
+            else:
+                invocation_path = self_adapt(solution, topology, app, credentials, latency_store=latency_store)
+            if invocation_path:
+                for node_ip in recovered_nodes:
+                    send_knowledge(node_ip, invocation_path, microservice_ports, microservices_dest, nodes_to_ips,
+                                   credentials, solution if balanced else None)
+        else:
             print(f'Start finding a new invocation path!')
-            invocation_path = self_adapt(solution, topology, app, credentials)
-            print(f'the application has recovered with the invocation path: {invocation_path}')
-            print(f'Continue to monitor the system')
+            if args.backup_paths:
+                invocation_path = backup_invocation_path(engine, failed_node_ids.values())
+                if invocation_path is None:
+                    print(f'No backup invocation path for this failure, solving it now')
+                    invocation_path = find_invocation_path(engine)
+            elif args.warm_start:
+                invocation_path = find_invocation_path(engine, failed_node_ids.values())
+            else:
+                if latency_monitor:
+                    latency_store = cached_latency_store(latency_monitor, credentials, args.staleness)
+                invocation_path = self_adapt(solution, topology, app, credentials, latency_store=latency_store)
+        if invocation_path:
+            push_invocation_path(invocation_path, nodes_to_ips, credentials, failed_ids,
+                                 solution if balanced else None)
+        print(f'the application has recovered with the invocation path: {invocation_path}')
+        print(f'time to recover = {millis() - adaptation_time} ms')
+        if args.warm_start and latency_monitor and invocation_path:
+            # the warm engine, and its backup invocation paths, follow the latencies measured since
+            latency_store = cached_latency_store(latency_monitor, credentials, args.staleness)
+            update_engine_latencies(engine, latency_store, args.backup_pairs, args.backup_paths)
+        elif args.backup_paths and invocation_path:
+            start_backup_paths(engine, args.backup_pairs)
+        print(f'Continue to monitor the system')
     else:
         print(f'The application functionality cannot be restored using the available resourses,\
          more available edge nodes are required!!!')
+    if args.warm_start:
+        stop_engine_refresh(engine_refresh)
+        stop_invocation_engine(engine)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,250 @@
+import argparse
+import contextlib
+import copy
+import io
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import requests
+from flask import Flask, request
+from werkzeug.serving import make_server
+from placementCycle.placement import find_replication, find_replication_incremental, find_replication_fast, millis, \
+    find_greedy_placement, find_joint_placement, mb_to_bytes, find_replication_pb, formula_size, \
+    find_parallel_placement
+
+
+def generate_topology(no_nodes, seed):
+    """
+    Generate a synthetic topology, no node is contacted
+    :param no_nodes: the number of edge nodes
+    :param seed: the seed used to draw the failure rates
+    :return: a list of (node id, failure rate) tuples
+    """
+    rand = random.Random(seed)
+    return [(str(n), round(rand.uniform(0.05, 0.6), 2)) for n in range(1, no_nodes + 1)]
+
+
+def generate_candidates(no_microservices, nodes_availability):
+    """
+    :param no_microservices: the number of microservices of the synthetic application
+    :param nodes_availability: a list of (node id, failure rate) tuples
+    :return: a dictionary where a key represents a microservice having the value a list of possible mapping nodes
+    """
+    return {f'm{m}': [n for n, _ in nodes_availability] for m in range(1, no_microservices + 1)}
+
+
+def generate_resources(nodes_availability, no_microservices, seed):
+    """
+    :param nodes_availability: a list of (node id, failure rate) tuples
+    :param no_microservices: the number of microservices of the synthetic application
+    :param seed: the seed used to draw the resources
+    :return: the available resources of every node and the resource requirements of every microservice in bytes
+    """
+    rand = random.Random(seed)
+    topology = {n: [mb_to_bytes(rand.choice([512, 1024, 2048])), mb_to_bytes(rand.choice([4096, 8192]))]
+                for n, _ in nodes_availability}
+    app_res = {f'm{m}': [mb_to_bytes(rand.randint(100, 600)), mb_to_bytes(900)]
+               for m in range(1, no_microservices + 1)}
+    return topology, app_res
+
+
+def placement_quality(solution, topology, app_res):
+    """
+    :param solution: a dictionary where key is a microservice and value is the list of nodes hosting its replicas
+    :param topology: the available resources of every node before the placement
+    :param app_res: the resource requirements of every microservice
+    :return: the total number of replicas, the unplaced microservices and the nodes whose capacity is exceeded
+    """
+    used = {n: [0] * len(resources) for n, resources in topology.items()}
+    for m, mapping in solution.items():
+        for n in mapping:
+            used[n] = [u + r for u, r in zip(used[n], app_res[m])]
+    overcommitted = [n for n, resources in topology.items() if any(u > r for u, r in zip(used[n], resources))]
+    unplaced = [m for m, mapping in solution.items() if not mapping]
+    return sum(len(mapping) for mapping in solution.values()), unplaced, overcommitted
+
+
+def benchmark_placement(candidates, topology, app_res, availability_req, nodes_availability, workers=None):
+    """
+    Compare the greedy per-microservice loop with the parallel placement and the joint placement model
+    :return: a dictionary where key is the placement mode and value is its time in ms and its quality
+    """
+    microservices = list(candidates)
+    # the closed-form search keeps the greedy loop clear of the non-linear unsatisfiable checks
+    placements = {'greedy': partial(find_greedy_placement, search=find_replication_fast),
+                  'parallel': partial(find_parallel_placement, search=find_replication_fast, workers=workers),
+                  'joint': find_joint_placement}
+    results = {}
+    for mode, placement in placements.items():
+        start_time = millis()
+        solution = placement(microservices, copy.deepcopy(candidates), copy.deepcopy(topology), app_res,
+                             availability_req, nodes_availability)
+        elapsed = millis() - start_time
+        results[mode] = (elapsed, ) + placement_quality(solution, topology, app_res)
+    return results
+
+
+def benchmark_replication(candidates, availability_req, nodes_availability):
+    """
+    Compare the cold, the incremental and the closed-form replica search for every microservice
+    :return: a dictionary where key is the search mode and value is the total solve time in ms
+    """
+    searches = {'cold': find_replication, 'incremental': find_replication_incremental, 'fast': find_replication_fast}
+    results = {mode: 0 for mode in searches}
+    for m in candidates:
+        mappings = {}
+        for mode, search in searches.items():
+            start_time = millis()
+            mappings[mode] = search(m, candidates, availability_req, nodes_availability)
+            results[mode] += millis() - start_time
+
+        print(f'{m}: {mappings}')
+        assert len(set(len(mapping) for mapping in mappings.values())) == 1
+    return results
+
+
+def benchmark_encoding(candidates, availability_req, nodes_availability):
+    """
+    Compare the replica symbols encoding with the pseudo-boolean encoding for every microservice
+    :return: a dictionary where key is the encoding and value is the total formula size and solve time in ms
+    """
+    searches = {'int': find_replication, 'pb': find_replication_pb}
+    results = {encoding: [0, 0] for encoding in searches}
+    for m in candidates:
+        for encoding, search in searches.items():
+            start_time = millis()
+            mapping = search(m, candidates, availability_req, nodes_availability)
+            results[encoding][1] += millis() - start_time
+            results[encoding][0] += formula_size(encoding, m, candidates, len(mapping), availability_req,
+                                                 nodes_availability)
+            print(f'{m}: {encoding} = {mapping}')
+    return results
+
+
+def start_server(app, port):
+    """Serve a Flask app in a background thread, the returned server is stopped with shutdown()"""
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def benchmark_forwarding(no_messages, batch_sizes, batch_window, senders, port=5400):
+    """
+    Load test the forwarding of node_api, the messages of m1 are forwarded by a local node to itself and then to a stub
+    m2 container counting them
+    :param no_messages: the number of messages sent for every batch size
+    :param batch_sizes: the batch sizes to compare, 1 disables the batching
+    :param batch_window: the number of ms a message waits for its batch to fill
+    :param senders: the number of threads posting the messages of m1
+    :return: a dictionary where key is the batch size and value is the throughput in messages per second and the
+    number of requests between the nodes
+    """
+    import node_api
+
+    received = []
+    container = Flask('m2')
+
+    @container.route('/m2', methods=['POST'])
+    def m2():
+        received.append(request.get_json())
+        return 'ok'
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    node = f'http://127.0.0.1:{port}'
+    servers = [start_server(node_api.app, port), start_server(container, port + 1)]
+    credentials = ('user', 'requestaccess')
+    requests.post(f'{node}/microservices_dest', json={'m1': ['m2']}, auth=credentials)
+    requests.post(f'{node}/microservices_ports', json={'cosminava/m2': [str(port + 1), str(port + 1)]},
+                  auth=credentials)
+    requests.post(f'{node}/invocation_path', json={'cosminava/m2': '1'}, auth=credentials)
+    requests.post(f'{node}/nodes_ips', json={'1': node}, auth=credentials)
+
+    results = {}
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=senders))
+    message = list(range(15))
+    for batch_size in batch_sizes:
+        requests.post(f'{node}/forwarding_mode', json={'mode': 'async', 'workers': senders, 'batch_size': batch_size,
+                                                       'batch_window': batch_window}, auth=credentials)
+        hops = requests.get(f'{node}/forward_stats', auth=credentials).json().get('node:1', {}).get('count', 0)
+        received.clear()
+        start_time = time.perf_counter()
+        # the node prints every message it forwards
+        with contextlib.redirect_stdout(io.StringIO()):
+            with ThreadPoolExecutor(max_workers=senders) as executor:
+                list(executor.map(lambda _: session.post(f'{node}/listening_containers', json=('m1', message)),
+                                  range(no_messages)))
+            while len(received) < no_messages:
+                time.sleep(0.001)
+        elapsed = time.perf_counter() - start_time
+        stats = requests.get(f'{node}/forward_stats', auth=credentials).json()['node:1']
+        results[batch_size] = (no_messages / elapsed, stats['count'] - hops)
+    for server in servers:
+        server.shutdown()
+    return results
+
+
+def parse_args():
+    """
+    Create the options and parse the arguments given as input by the user.
+    :return: an argparse object.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the placement cycle on a synthetic topology.')
+    parser.add_argument('-n', '--nodes', type=int, default=60, help='The number of synthetic edge nodes.')
+    parser.add_argument('-m', '--microservices', type=int, default=4, help='The number of microservices.')
+    parser.add_argument('-s', '--sla', type=float, default=0.99, help='The availability requirement.')
+    parser.add_argument('-b', '--benchmark', type=str, default='replication',
+                        choices=['replication', 'placement', 'encoding', 'forwarding'],
+                        help='Benchmark the replica search, the greedy and joint placements, the encodings or the '
+                             'forwarding of the messages between microservices.')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='The number of processes of the parallel placement, every core by default.')
+    parser.add_argument('--seed', type=int, default=0, help='The seed used to generate the topology.')
+    parser.add_argument('--messages', type=int, default=2000, help='The number of forwarded messages.')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32],
+                        help='The batch sizes compared by the forwarding benchmark.')
+    parser.add_argument('--batch-window', type=float, default=5,
+                        help='The number of ms a message waits for its batch to fill.')
+    parser.add_argument('--senders', type=int, default=8, help='The number of threads sending messages.')
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_args()
+    nodes_availability = generate_topology(args.nodes, args.seed)
+    candidates = generate_candidates(args.microservices, nodes_availability)
+
+    if args.benchmark == 'forwarding':
+        print(f'Forwarding {args.messages} messages with {args.senders} senders...')
+        results = benchmark_forwarding(args.messages, args.batch_sizes, args.batch_window, args.senders)
+        for batch_size, (throughput, requests_sent) in results.items():
+            print(f'batch size = {batch_size}, throughput = {throughput:.0f} msg/s, '
+                  f'requests between nodes = {requests_sent}')
+        return
+
+    if args.benchmark == 'replication':
+        print(f'Replica search on {args.nodes} nodes and {args.microservices} microservices...')
+        results = benchmark_replication(candidates, args.sla, nodes_availability)
+        for mode, elapsed in results.items():
+            print(f'{mode} time = {elapsed} ms')
+    elif args.benchmark == 'encoding':
+        print(f'Encodings on {args.nodes} nodes and {args.microservices} microservices...')
+        results = benchmark_encoding(candidates, args.sla, nodes_availability)
+        for encoding, (size, elapsed) in results.items():
+            print(f'{encoding} formula size = {size}, time = {elapsed} ms')
+    else:
+        print(f'Placement on {args.nodes} nodes and {args.microservices} microservices...')
+        topology, app_res = generate_resources(nodes_availability, args.microservices, args.seed)
+        results = benchmark_placement(candidates, topology, app_res, args.sla, nodes_availability, args.workers)
+        for mode, (elapsed, replicas, unplaced, overcommitted) in results.items():
+            print(f'{mode} time = {elapsed} ms, replicas = {replicas}, unplaced = {unplaced}, '
+                  f'overcommitted nodes = {overcommitted}')
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,138 @@
+import json
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+CBOR = 'application/cbor'
+# the msgpack extension type and the CBOR tag of a NumPy array, i.e., its dtype, its shape and its raw buffer
+NDARRAY_EXT = 42
+NDARRAY_TAG = 4242
+
+
+def json_default(obj):
+    """Encode the NumPy arrays and scalars as JSON lists and numbers"""
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def array_fields(array):
+    """:return: the dtype, the shape and a view of the buffer of a NumPy array, the buffer is not copied"""
+    array = np.ascontiguousarray(array)
+    return [array.dtype.str, list(array.shape), memoryview(array).cast('B')]
+
+
+def array_from_fields(dtype, shape, buffer):
+    """:return: a read-only NumPy array on top of the received buffer, the buffer is not copied"""
+    return np.frombuffer(buffer, dtype=np.dtype(dtype)).reshape(shape)
+
+
+def msgpack_default(obj):
+    if isinstance(obj, np.ndarray):
+        return msgpack.ExtType(NDARRAY_EXT, msgpack.packb(array_fields(obj)))
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f'Object of type {type(obj).__name__} is not msgpack serializable')
+
+
+def msgpack_ext_hook(code, data):
+    if code == NDARRAY_EXT:
+        return array_from_fields(*msgpack.unpackb(data))
+    return msgpack.ExtType(code, data)
+
+
+def cbor_default(encoder, obj):
+    if isinstance(obj, np.ndarray):
+        dtype, shape, buffer = array_fields(obj)
+        encoder.encode(cbor2.CBORTag(NDARRAY_TAG, [dtype, shape, bytes(buffer)]))
+    elif isinstance(obj, np.generic):
+        encoder.encode(obj.item())
+    else:
+        raise TypeError(f'Object of type {type(obj).__name__} is not CBOR serializable')
+
+
+def cbor_tag_hook(*args):
+    # cbor2 calls the hook with (decoder, tag) before version 6 and with (tag, immutable) since
+    tag = args[1] if len(args) > 1 and isinstance(args[1], cbor2.CBORTag) else args[0]
+    if tag.tag == NDARRAY_TAG:
+        return array_from_fields(*tag.value)
+    return tag
+
+
+def available_codecs():
+    """:return: the content types this node can encode and decode, the preferred ones first"""
+    codecs = []
+    if msgpack is not None:
+        codecs.append(MSGPACK)
+    if cbor2 is not None:
+        codecs.append(CBOR)
+    return codecs + [JSON]
+
+
+def encode(obj, content_type=JSON):
+    """
+    :param obj: the message, NumPy arrays are sent as raw buffers by msgpack and CBOR
+    :param content_type: the content type of the encoded message
+    :return: the encoded message
+    """
+    if content_type == MSGPACK:
+        return msgpack.packb(obj, default=msgpack_default, use_bin_type=True)
+    if content_type == CBOR:
+        return cbor2.dumps(obj, default=cbor_default)
+    return json.dumps(obj, default=json_default).encode('utf-8')
+
+
+def decode(data, content_type=JSON):
+    """
+    :param data: the encoded message
+    :param content_type: the content type of the message, a missing content type is decoded as JSON
+    :return: the decoded message, a ValueError is raised if the content type is not supported
+    """
+    content_type = (content_type or JSON).split(';')[0].strip()
+    if content_type not in available_codecs():
+        raise ValueError(f'Unsupported content type {content_type}')
+    if content_type == MSGPACK:
+        return msgpack.unpackb(data, ext_hook=msgpack_ext_hook, raw=False)
+    if content_type == CBOR:
+        return cbor2.loads(data, tag_hook=cbor_tag_hook)
+    return json.loads(data)
+
+
+def negotiate(accept, preferred=None):
+    """
+    :param accept: the content types accepted by the peer, e.g., the Accept header of a 415 answer
+    :param preferred: the content type to use when the peer accepts it
+    :return: the first content type accepted by the peer and supported by this node, JSON otherwise
+    """
+    accepted = [content_type.split(';')[0].strip() for content_type in (accept or '').split(',')]
+    candidates = ([preferred] if preferred else []) + available_codecs()
+    for content_type in candidates:
+        if content_type in accepted:
+            return content_type
+    return JSON
+
+
+def post(session, url, payload, content_type=JSON, **kwargs):
+    """
+    Post a message encoded with the content type, a peer answering 415 Unsupported Media Type gets the message again
+    in a content type it accepts
+    :param session: a requests session or the requests module
+    :return: the response and the content type the peer accepted
+    """
+    headers = dict(kwargs.pop('headers', None) or {}, **{'Content-Type': content_type})
+    resp = session.post(url, data=encode(payload, content_type), headers=headers, **kwargs)
+    if resp.status_code == 415 and content_type != JSON:
+        content_type = negotiate(resp.headers.get('Accept'))
+        headers['Content-Type'] = content_type
+        resp = session.post(url, data=encode(payload, content_type), headers=headers, **kwargs)
+    return resp, content_type
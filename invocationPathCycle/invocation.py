@@ -1,14 +1,29 @@
 from pysmt.shortcuts import Symbol, And, Plus, Int, ExactlyOne, Equals, get_formula_size, LE, Or, Not, Real, GE
+from pysmt.shortcuts import FALSE
 from pysmt.shortcuts import Solver
 from pysmt.typing import INT, REAL
+from fractions import Fraction
+import math
 import random
 import json
 import time
-import subprocess
+import numpy as np
 import typing
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+from threading import Event, Lock, Thread
 import requests
 from requests.auth import HTTPBasicAuth
 from placementCycle.placement import create_objective, microservice, availability
+from probe import probe_all, parse_address, PROBE_MODE
+
+# the default number of probes sent to every peer and the number of seconds to wait for each of them
+PROBE_COUNT = 3
+PROBE_DEADLINE = 2
+# the number of seconds between two checks of the latencies of a warm invocation engine and the relative change of a
+# link latency that makes the engine load the new latencies
+ENGINE_REFRESH_INTERVAL = 10
+LATENCY_CHANGE = 0.2
 
 
 def find_topology(nodes):
@@ -24,55 +39,129 @@ def find_topology(nodes):
     return nodes_failures_probs
 
 
-def find_latency(node_ip: str):
+def find_latency(node_ip: str, mode: str = PROBE_MODE):
     """
     Get the average latency of a node
-    :param node_ip: the ip address of a node
-    :return: the average latency to communicate with the node, considering 10 pings
+    :param node_ip: the address of a node, e.g., http://127.0.0.1:5000
+    :param mode: 'tcp' for the TCP connect time or 'http' for the round trip time of an HTTP request
+    :return: the average latency to communicate with the node, considering 10 probes, None if it did not answer
+    """
+    summary = probe_all({node_ip: parse_address(node_ip)}, mode, count=10)[node_ip]
+    return summary['avg'] if summary else None
+
+
+def create_latency_store(node_ids):
     """
-    results = subprocess.run(['ping', '-c', '10', node_ip], stdout=subprocess.PIPE).stdout.decode('utf-8')
+    :param node_ids: the ids of the nodes
+    :return: a latency store, i.e., a dictionary holding the index of every node id and a matrix where the element
+    (i, j) is the latency between the nodes with index i and j, NaN marks a missing link
+    """
+    ids = {str(n): i for i, n in enumerate(node_ids)}
+    return {'ids': ids, 'matrix': np.full((len(ids), len(ids)), np.nan)}
+
+
+def set_latency(n1, n2, latency, latency_store):
+    """Save the latency from node n1 to node n2 in the latency store"""
+    latency_store['matrix'][latency_store['ids'][str(n1)], latency_store['ids'][str(n2)]] = int(float(latency))
 
-    return results.split('\n')[-2].split(' = ')[1].split('/')[1]
 
+def probe_node(node, nodes, credentials, probe_count, probe_deadline):
+    """
+    Send the topology to a node and get its latency to every other node
+    :param node: the node that measures its latencies
+    :param nodes: the list of nodes
+    :param credentials: the credentials used to query the nodes
+    :param probe_count: the number of probes sent to every peer
+    :param probe_deadline: the number of seconds to wait for each probe
+    :return: a dictionary where key is a peer node id and value is the latency to it, empty if the node failed
+    """
+    try:
+        resp_nodes = requests.post(node['ip'] + '/nodes', json=nodes, auth=credentials, timeout=100)
+        print(f'{node["id"]}: {resp_nodes.status_code}')
+        resp_latency = requests.get(node['ip'] + '/get_latency', params={'count': probe_count,
+                                                                         'deadline': probe_deadline},
+                                    auth=credentials, timeout=probe_count * (probe_deadline + 1) + 20)
+        return resp_latency.json()
+    except requests.exceptions.RequestException as e:
+        print(f'Could not get the latencies of node {node["id"]}: {e}')
+        return {}
 
-def build_latency_dict(nodes, credentials):
+
+def build_latency_store(nodes, credentials, probe_count=PROBE_COUNT, probe_deadline=PROBE_DEADLINE):
     """
     :param nodes: the list of nodes
-    :return: a dictionary containing the latencies between two nodes, where key is a string showing the
-    communication link between two nodes, while the value represents the communication latency between them.
+    :param credentials: the credentials used to query the nodes
+    :param probe_count: the number of probes sent to every peer
+    :param probe_deadline: the number of seconds to wait for each probe
+    :return: a latency store containing the latencies between every two nodes
     """
-    latencies = {}
-    nodes_latencies = {}
     print(f'List of nodes: {nodes}')
 
     print(f'Send the topology to all nodes and get the latency')
-    for node in nodes:
-        resp_nodes = requests.post(node['ip'] + '/nodes', json=nodes, auth=credentials, timeout=100)
-        print(resp_nodes.status_code)
-        resp_latency = requests.get(node['ip'] + '/get_latency', auth=credentials, timeout=500)
-        latencies[node['id']] = resp_latency.json()
+    with ThreadPoolExecutor(max_workers=len(nodes) or 1) as executor:
+        futures = {node['id']: executor.submit(probe_node, node, nodes, credentials, probe_count, probe_deadline)
+                   for node in nodes}
+        latencies = {node_id: future.result() for node_id, future in futures.items()}
 
+    latency_store = create_latency_store(node['id'] for node in nodes)
     for src_id, latency_dict in latencies.items():
         for dest_id, latency in latency_dict.items():
-            s = f'{src_id}-{dest_id}'
-            nodes_latencies[s] = int(float(latency))
+            if str(dest_id) in latency_store['ids']:
+                set_latency(src_id, dest_id, latency, latency_store)
 
-    return nodes_latencies
+    min_latencies, mean_latencies = latency_summary(latency_store)
+    print(f'Minimum latency of every node: {min_latencies}')
+    print(f'Mean latency of every node: {mean_latencies}')
+    return latency_store
 
 
-def get_latency(n1, n2, latency_dict):
+def get_latency(n1, n2, latency_store):
     """
     :param n1: the source, where a microservice is placed.
     :param n2: the destination, where a microservice is placed.
-    :param latency_dict:  a dictionary containing the latency between dependent microservices
-    :return: the latency between the two nodes.
+    :param latency_store:  a latency store containing the latencies between every two nodes
+    :return: the latency between the two nodes, None if the link is missing.
     """
-    print(f'The latency dict is: {latency_dict}')
-    s = f'{n1}-{n2}'
-    print(f'Looking for the following group: {s}')
-    if s in latency_dict:
-        latency = latency_dict[s]
-    return latency
+    i = latency_store['ids'].get(str(n1))
+    j = latency_store['ids'].get(str(n2))
+    if i is None or j is None or np.isnan(latency_store['matrix'][i, j]):
+        return None
+    return int(latency_store['matrix'][i, j])
+
+
+def latency_matrix(src_nodes, dst_nodes, latency_store):
+    """
+    :param src_nodes: the nodes hosting the source microservice
+    :param dst_nodes: the nodes hosting the destination microservice
+    :param latency_store:  a latency store containing the latencies between every two nodes
+    :return: a matrix where the element (i, j) is the latency between src_nodes[i] and dst_nodes[j], a missing link
+    has an infinite latency
+    """
+    ids = latency_store['ids']
+    matrix = latency_store['matrix']
+    # an unknown node is mapped on an extra row and column of missing links
+    rows = [ids.get(str(n), -1) for n in src_nodes]
+    cols = [ids.get(str(n), -1) for n in dst_nodes]
+    if -1 in rows or -1 in cols:
+        matrix = np.pad(matrix, (0, 1), constant_values=np.nan)
+    sub_matrix = matrix[np.ix_(rows, cols)]
+    return np.where(np.isnan(sub_matrix), np.inf, sub_matrix)
+
+
+def latency_summary(latency_store):
+    """
+    :param latency_store:  a latency store containing the latencies between every two nodes
+    :return: two dictionaries having as key the node id and as value its minimum and mean latency to the other nodes
+    """
+    matrix = latency_store['matrix'].copy()
+    np.fill_diagonal(matrix, np.nan)
+    known = ~np.isnan(matrix).all(axis=1)
+    min_latencies = np.full(len(matrix), np.nan)
+    mean_latencies = np.full(len(matrix), np.nan)
+    min_latencies[known] = np.nanmin(matrix[known], axis=1)
+    mean_latencies[known] = np.nanmean(matrix[known], axis=1)
+    return ({n: float(min_latencies[i]) for n, i in latency_store['ids'].items()},
+            {n: float(mean_latencies[i]) for n, i in latency_store['ids'].items()})
 
 
 def get_deployment_solution(file_name):
@@ -139,12 +228,12 @@ def create_latency_constraint(app):
     return LE(Plus(problem), Int(int(app["IoTapplication"]["SLA"]['e2e']))), problem, dependencies, microservices
 
 
-def create_microservice_facts(dependencies, microservices_on_nodes, latency_dict):
+def create_microservice_facts(dependencies, microservices_on_nodes, latency_store):
     """
     :param dependencies:
     :param microservices_on_nodes: a dictionary containing a solution where key is a microservice and value
     is a list of nodes
-    :param latency_dict:  a dictionary containing the latency between dependent microservices
+    :param latency_store:  a latency store containing the latencies between every two nodes
     :return: a SMT encoding containing the latency between two microservices.
     """
     microservice_facts = []
@@ -152,9 +241,11 @@ def create_microservice_facts(dependencies, microservices_on_nodes, latency_dict
         if grp[0] in microservices_on_nodes and grp[1] in microservices_on_nodes:
             for n1 in microservices_on_nodes[grp[0]]:
                 for n2 in microservices_on_nodes[grp[1]]:
+                    link_latency = get_latency(n1, n2, latency_store)
+                    # a missing link cannot be part of the invocation path
+                    fact = FALSE() if link_latency is None else Equals(latency(grp[0], grp[1]), Int(link_latency))
                     microservice_facts.append(And(Equals(microservice(grp[0]), Int(int(n1))), Equals(microservice(grp[1]),
-                                    Int(int(n2)))).Implies(Equals(latency(grp[0], grp[1]),
-                                                                  Int(get_latency(n1, n2, latency_dict)))))
+                                    Int(int(n2)))).Implies(fact))
     return And(microservice_facts)
 
 
@@ -197,20 +288,20 @@ def microservice_availability_encoding(microservices_on_nodes, nodes_failures):
     return And(encoding), avail_obj
 
 
-# A context (with-statment) lets python take care of creating and
-# destroying the solver.
-def self_adapt(solution, nodes, application, credentials):
-
-    nodes_failures = find_topology(nodes)
-    latency_dict = build_latency_dict(nodes, credentials)
-
+def invocation_formula(solution, nodes_failures, application, latency_store):
+    """
+    :param solution: the current placement solution
+    :param nodes_failures: a dictionary where the failure rate of all nodes is stored
+    :param application: the JSON dictionary where the model of the app is described
+    :param latency_store:  a latency store containing the latencies between every two nodes
+    :return: the SMT formula of the invocation path, the microservice symbols, the latency symbols and a dictionary
+    containing the nodes of every microservice
+    """
     #create the three encodings for the SMT formula
     problem, latencies, dependencies, microservices = create_latency_constraint(application)
 
-    start_time = millis()
-    print(f'Starting to find an invocation chain...')
     microservices_on_nodes = find_microservices_on_nodes(solution)
-    microservice_facts = create_microservice_facts(dependencies, microservices_on_nodes, latency_dict)
+    microservice_facts = create_microservice_facts(dependencies, microservices_on_nodes, latency_store)
     microservice_possibilities = create_microservices_possibilities(microservices_on_nodes)
     availability_enc, avail_obj = microservice_availability_encoding(microservices_on_nodes, nodes_failures)
     problem_availability = create_objective(avail_obj, application["IoTapplication"]["SLA"]['availability'])
@@ -219,7 +310,112 @@ def self_adapt(solution, nodes, application, credentials):
     f1 = microservice_possibilities.And(microservice_facts)
     f2 = f1.And(availability_enc)
     f3 = f2.And(problem_availability)
-    formula = f3.And(problem)
+    return f3.And(problem), microservices, latencies, microservices_on_nodes
+
+
+def is_tree_shaped(dependencies):
+    """
+    :param dependencies: a list of dependencies between microservices
+    :return: true if the application graph is a DAG where every microservice has at most one source, e.g., a chain
+    """
+    sources = {}
+    for m1, m2 in dependencies:
+        if m2 in sources:
+            return False
+        sources[m2] = m1
+    for m in sources:
+        visited = set()
+        while m in sources:
+            if m in visited:
+                return False
+            visited.add(m)
+            m = sources[m]
+    return True
+
+
+def find_invocation_path_dp(microservices_on_nodes, dependencies, latency_store, nodes_failures, application):
+    """
+    Pick one node per microservice minimizing the end-to-end latency of a tree-shaped application. The best latency
+    of every node of a microservice is its latency to the nodes of its destinations plus their own best latency,
+    computed from the leaves to the roots over the latency matrices.
+    :param microservices_on_nodes: a dictionary containing a solution where key is a microservice and value
+    is a list of nodes
+    :param dependencies: a list of dependencies between microservices, the graph must be tree-shaped
+    :param latency_store:  a latency store containing the latencies between every two nodes
+    :param nodes_failures: a dictionary where the failure rate of all nodes is stored
+    :param application: the JSON dictionary where the model of the app is described
+    :return: the latency-optimal invocation path and its latency, an empty path if the latency or availability
+    requirement is violated, or None when the availability requirement is violated and the solver must decide
+    """
+    microservices = list(microservices_on_nodes)
+    if any(not microservices_on_nodes[m] for m in microservices):
+        return dict(), None
+    destinations = {m: [] for m in microservices}
+    for m1, m2 in dependencies:
+        destinations[m1].append(m2)
+    roots = [m for m in microservices if all(m != m2 for _, m2 in dependencies)]
+
+    # visit the microservices from the leaves to the roots
+    order = []
+    stack = list(roots)
+    while stack:
+        m = stack.pop()
+        order.append(m)
+        stack.extend(destinations[m])
+    cost = {}
+    choice = {}
+    for m in reversed(order):
+        cost[m] = np.zeros(len(microservices_on_nodes[m]))
+        for d in destinations[m]:
+            total = latency_matrix(microservices_on_nodes[m], microservices_on_nodes[d], latency_store) + cost[d]
+            choice[(m, d)] = total.argmin(axis=1)
+            cost[m] += total.min(axis=1)
+
+    invocation_path = dict()
+    best_latency = 0
+    stack = []
+    for m in roots:
+        best = int(cost[m].argmin())
+        best_latency += cost[m][best]
+        stack.append((m, best))
+    while stack:
+        m, i = stack.pop()
+        invocation_path[m] = microservices_on_nodes[m][i]
+        stack.extend((d, int(choice[(m, d)][i])) for d in destinations[m])
+
+    if best_latency > int(application["IoTapplication"]["SLA"]['e2e']):
+        return dict(), best_latency
+    # the same objective as create_objective
+    product = Fraction(1)
+    for n in invocation_path.values():
+        product *= Fraction(float(1 - nodes_failures[n]))
+    if 1 - product < Fraction(application["IoTapplication"]["SLA"]['availability']):
+        return None, best_latency
+    return invocation_path, best_latency
+
+
+# A context (with-statment) lets python take care of creating and
+# destroying the solver.
+def self_adapt(solution, nodes, application, credentials, use_dp=True, latency_store=None):
+
+    nodes_failures = find_topology(nodes)
+    if latency_store is None:
+        latency_store = build_latency_store(nodes, credentials)
+
+    start_time = millis()
+    print(f'Starting to find an invocation chain...')
+    _, _, dependencies, _ = create_latency_constraint(application)
+    if use_dp and is_tree_shaped(dependencies):
+        invocation_path, best_latency = find_invocation_path_dp(find_microservices_on_nodes(solution), dependencies,
+                                                                latency_store, nodes_failures, application)
+        if invocation_path is not None:
+            for m, n in invocation_path.items():
+                print(f'{m} = {n}')
+            print(f'best end-to-end latency = {best_latency}')
+            print(f'time =  {millis() - start_time} ms')
+            return invocation_path
+        print(f'The latency-optimal path violates the availability requirement, falling back to the solver')
+    formula, microservices, latencies, _ = invocation_formula(solution, nodes_failures, application, latency_store)
 
     invocation_path = dict()
 
@@ -237,5 +433,223 @@ def self_adapt(solution, nodes, application, credentials):
     return invocation_path
 
 
+def create_invocation_engine(solution, nodes, application, credentials, latency_store=None):
+    """
+    Build the invocation path formula once and keep its solver alive. The failed nodes are excluded through
+    assumptions, so a failure only requires a new check instead of rebuilding every encoding.
+    :param solution: the current placement solution
+    :param nodes: the list of available nodes
+    :param application: the JSON dictionary where the model of the app is described
+    :param credentials: the credentials used to query the nodes
+    :param latency_store: the latencies between every two nodes, they are measured if it is not given
+    :return: a dictionary holding the solver, the symbols of the formula, the set of failed nodes and the table of
+    backup invocation paths
+    """
+    engine = {'solution': solution, 'application': application, 'nodes_failures': find_topology(nodes),
+              'failed_nodes': set(), 'backup_paths': {}, 'lock': Lock()}
+    if latency_store is None:
+        latency_store = build_latency_store(nodes, credentials)
+    load_engine_latencies(engine, latency_store)
+    return engine
+
+
+def load_engine_latencies(engine, latency_store):
+    """
+    (Re)build the solver of the engine for the given latencies
+    :param engine: the invocation engine created by create_invocation_engine
+    :param latency_store:  a latency store containing the latencies between every two nodes
+    """
+    formula, microservices, latencies, microservices_on_nodes = invocation_formula(engine['solution'],
+                                                                                   engine['nodes_failures'],
+                                                                                   engine['application'],
+                                                                                   latency_store)
+    _, _, dependencies, _ = create_latency_constraint(engine['application'])
+    solver = Solver()
+    solver.add_assertion(formula)
+    with engine['lock']:
+        if 'solver' in engine:
+            engine['solver'].exit()
+        engine.update(solver=solver, microservices=microservices, latencies=latencies, dependencies=dependencies,
+                      microservices_on_nodes=microservices_on_nodes, latency_store=latency_store)
+
+
+def solve_invocation_path(engine, failed_nodes):
+    """
+    :param engine: the invocation engine created by create_invocation_engine
+    :param failed_nodes: the ids of all nodes that must not be part of the invocation path
+    :return: the invocation path, an empty dictionary if there is none
+    """
+    assumptions = [Not(Equals(microservice(m), Int(int(n))))
+                   for m, nodes in engine['microservices_on_nodes'].items()
+                   for n in nodes if n in failed_nodes]
+    with engine['lock']:
+        solver = engine['solver']
+        if not solver.solve(assumptions):
+            return dict()
+        return {str(m): str(solver.get_value(m)) for m in engine['microservices']}
+
+
+def find_invocation_path(engine, failed_nodes=(), recovered_nodes=()):
+    """
+    Re-check the formula of the engine after excluding the failed nodes
+    :param engine: the invocation engine created by create_invocation_engine
+    :param failed_nodes: the ids of the nodes that failed since the last check
+    :param recovered_nodes: the ids of the nodes that are available again
+    :return: the invocation path, an empty dictionary if there is none
+    """
+    engine['failed_nodes'].update(str(n) for n in failed_nodes)
+    engine['failed_nodes'].difference_update(str(n) for n in recovered_nodes)
+
+    start_time = millis()
+    print(f'Starting to find an invocation chain without the nodes {engine["failed_nodes"]}...')
+    invocation_path = solve_invocation_path(engine, engine['failed_nodes'])
+    for m, n in invocation_path.items():
+        print(f'{m} = {n}')
+    if not invocation_path:
+        print("No solution found")
+    print(f'time =  {millis() - start_time} ms')
+    return invocation_path
+
+
+def failure_scenarios(engine, pairs=False):
+    """
+    :param engine: the invocation engine created by create_invocation_engine
+    :param pairs: if it is true then the failure of every pair of nodes is considered as well
+    :return: a list of failure scenarios, each one is the sorted tuple of all nodes failed in that scenario
+    """
+    failed_nodes = set(engine['failed_nodes'])
+    used_nodes = sorted({n for nodes in engine['microservices_on_nodes'].values() for n in nodes} - failed_nodes)
+    scenarios = [(n,) for n in used_nodes]
+    if pairs:
+        scenarios.extend(combinations(used_nodes, 2))
+    return [tuple(sorted(failed_nodes.union(scenario))) for scenario in scenarios]
+
+
+def precompute_backup_paths(engine, pairs=False):
+    """
+    Fill the table of backup invocation paths with the failure scenarios that are still missing
+    :param engine: the invocation engine created by create_invocation_engine
+    :param pairs: if it is true then the failure of every pair of nodes is considered as well
+    """
+    start_time = millis()
+    scenarios = [s for s in failure_scenarios(engine, pairs) if s not in engine['backup_paths']]
+    for scenario in scenarios:
+        engine['backup_paths'][scenario] = solve_invocation_path(engine, scenario)
+    print(f'Precomputed {len(scenarios)} backup invocation paths in {millis() - start_time} ms')
+
+
+def start_backup_paths(engine, pairs=False):
+    """
+    Precompute the backup invocation paths in the background
+    :param engine: the invocation engine created by create_invocation_engine
+    :param pairs: if it is true then the failure of every pair of nodes is considered as well
+    :return: the thread filling the table
+    """
+    thread = Thread(target=precompute_backup_paths, args=(engine, pairs), daemon=True)
+    thread.start()
+    return thread
+
+
+def backup_invocation_path(engine, failed_nodes):
+    """
+    :param engine: the invocation engine created by create_invocation_engine
+    :param failed_nodes: the ids of the nodes that failed since the last check
+    :return: the precomputed invocation path of the current failure scenario, None if it was not computed yet
+    """
+    engine['failed_nodes'].update(str(n) for n in failed_nodes)
+    return engine['backup_paths'].get(tuple(sorted(engine['failed_nodes'])))
+
+
+def path_latency(invocation_path, dependencies, latency_store):
+    """
+    :param invocation_path: a dictionary where key is a microservice and value is its node
+    :param dependencies: a list of dependencies between microservices
+    :param latency_store:  a latency store containing the latencies between every two nodes
+    :return: the end-to-end latency of the invocation path
+    """
+    links = [get_latency(invocation_path[m1], invocation_path[m2], latency_store) for m1, m2 in dependencies]
+    return math.inf if None in links else sum(links)
+
+
+def update_engine_latencies(engine, latency_store, pairs=False, backup=True):
+    """
+    Load new latencies in the engine, then only the backup invocation paths that no longer satisfy the end-to-end
+    requirement, or had no solution, are computed again in the background
+    :param engine: the invocation engine created by create_invocation_engine
+    :param latency_store:  a latency store containing the latencies between every two nodes
+    :param pairs: if it is true then the failure of every pair of nodes is considered as well
+    :param backup: if it is false then the engine keeps no backup invocation paths and only loads the latencies
+    :return: the thread refreshing the table, None without backup invocation paths
+    """
+    load_engine_latencies(engine, latency_store)
+    if not backup:
+        return None
+    e2e = int(engine['application']["IoTapplication"]["SLA"]['e2e'])
+    for scenario, invocation_path in list(engine['backup_paths'].items()):
+        if not invocation_path or path_latency(invocation_path, engine['dependencies'], latency_store) > e2e:
+            del engine['backup_paths'][scenario]
+    return start_backup_paths(engine, pairs)
+
+
+def latencies_changed(old_store, new_store, tolerance=LATENCY_CHANGE):
+    """
+    :param old_store: the latency store loaded in an engine
+    :param new_store: the latency store measured since
+    :param tolerance: the relative change of a link latency that is considered a change
+    :return: true if a link appeared, disappeared or its latency changed by more than the tolerance
+    """
+    if old_store['ids'] != new_store['ids'] or \
+            not np.array_equal(np.isnan(old_store['matrix']), np.isnan(new_store['matrix'])):
+        return True
+    known = ~np.isnan(old_store['matrix'])
+    old, new = old_store['matrix'][known], new_store['matrix'][known]
+    return bool(np.any(np.abs(new - old) > tolerance * np.maximum(old, 1)))
+
+
+def refresh_engine_latencies(refresher, latest_latencies, interval, pairs, backup):
+    """
+    Check the latencies every interval seconds, the engine of the refresher loads them once they changed
+    :param refresher: the refresher created by start_engine_refresh
+    :param latest_latencies: a function returning a latency store with the current latencies
+    """
+    while not refresher['event'].wait(interval):
+        engine = refresher['engine']
+        try:
+            latency_store = latest_latencies()
+        except requests.exceptions.RequestException as e:
+            print(f'Could not measure the latencies to refresh the invocation engine: {e}')
+            continue
+        if latencies_changed(engine['latency_store'], latency_store):
+            print(f'The latencies changed, the invocation engine and its backup invocation paths are refreshed')
+            update_engine_latencies(engine, latency_store, pairs, backup)
+
+
+def start_engine_refresh(engine, latest_latencies, interval=ENGINE_REFRESH_INTERVAL, pairs=False, backup=True):
+    """
+    Keep the latencies of a warm invocation engine, and of its backup invocation paths, up to date in the background
+    :param engine: the invocation engine created by create_invocation_engine
+    :param latest_latencies: a function returning a latency store with the current latencies
+    :param interval: the number of seconds between two checks of the latencies
+    :param pairs: if it is true then the failure of every pair of nodes is considered as well
+    :param backup: if it is false then the engine keeps no backup invocation paths and only loads the latencies
+    :return: a refresher, i.e., a dictionary holding the engine, replaced when the engine is created again
+    """
+    refresher = {'engine': engine, 'event': Event()}
+    Thread(target=refresh_engine_latencies, args=(refresher, latest_latencies, interval, pairs, backup),
+           daemon=True).start()
+    return refresher
+
+
+def stop_engine_refresh(refresher):
+    """Stop the background thread of the refresher"""
+    refresher['event'].set()
+
+
+def stop_invocation_engine(engine):
+    """Destroy the solver kept alive by the invocation engine"""
+    with engine['lock']:
+        engine['solver'].exit()
+
+
 def millis():
     return int(round(time.time() * 1000))
@@ -1,47 +1,351 @@
+import asyncio
+import heapq
+import queue
 import time
-from placementCycle.placement import check_alive
-from threading import Thread, Event
-from requests.auth import HTTPBasicAuth
+from collections import deque
+from invocationPathCycle.invocation import create_latency_store
+from probe import parse_address
+from threading import Thread, Event, Lock
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import requests
-import json
 
 
 monitoring_results = {}
+# the status changes of the nodes, i.e., (node IP, 'up' or 'down') tuples consumed by the adaptation loop
+monitoring_events = queue.Queue()
+detector_event = Event()
+# the number of seconds between two probes of a node and the number of seconds to wait for a probe
+MONITORING_INTERVAL = 1
+MONITORING_TIMEOUT = 1
+# a node is down when k of its last n probes failed
+MONITORING_SUSPICION = (2, 3)
+# the number of seconds between two heartbeats and the number of missed heartbeats after which a node is down
+HEARTBEAT_INTERVAL = 1
+HEARTBEAT_MISSES = 3
+# the last heartbeat of every node and a heap of (deadline, node, sequence number) for the expected heartbeats
+heartbeats = {}
+heartbeat_config = {'interval': HEARTBEAT_INTERVAL, 'misses': HEARTBEAT_MISSES}
+heartbeat_deadlines = []
+heartbeat_lock = Lock()
+heartbeat_event = Event()
+# the weight of a new latency sample in the moving average
+LATENCY_ALPHA = 0.3
+# the number of links probed every second by the background latency monitor
+LATENCY_BUDGET = 10
+# the number of seconds after which a cached latency is measured again before it is used
+LATENCY_STALENESS = 60
 
 
-def monitor_node_failure(node):
-    global results_dict
-    event = Event()
-    print(f'Start monitoring node {node}...')
-    credentials_central = HTTPBasicAuth('admin', 'requestaccess')
-    while not event.is_set():
-        flag = 'up'
-        time.sleep(1) # sleep for 100 ms
-        if not check_alive(node):
-            # print(f'Node with IP {node} has failed')
-            flag = 'down'
-            event.set()
-        monitoring_results[node] = flag
-        # print(f'{results_dict} from within the thread of node = {node}')
-
-        # resp = requests.post(f'http://{LOCALHOST}:5000/save_status', json=(node, flag), auth=credentials_central, timeout=20)
-
-
-def start_monitoring(nodes_to_ips):
-    threads = []
-    # try:
-    print(f'Starting the processes')
-    for node in nodes_to_ips.values():
-        p = Thread(target=monitor_node_failure, args=(node,))
-        p.start()
-        threads.append(p)
+async def probe_alive(node, timeout):
+    """
+    :param node: the address of a node, e.g., http://127.0.0.1:5000
+    :param timeout: the number of seconds to wait for the connection
+    :return: true if a TCP connection to the node is established within the timeout
+    """
+    host, port = parse_address(node)
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        writer.close()
+        return True
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+
+async def watch_node(node, interval, timeout, suspicion):
+    """
+    Probe a node every interval seconds. The node is suspected to be down when at least k of the last n probes
+    failed, and it is up again once fewer than k of the last n probes failed. monitoring_results is only written when
+    the status of the node changes.
+    :param node: the address of a node, e.g., http://127.0.0.1:5000
+    :param interval: the number of seconds between two probes
+    :param timeout: the number of seconds to wait for a probe
+    :param suspicion: the tuple (k, n)
+    """
+    k, n = suspicion
+    history = deque(maxlen=n)
+    status = None
+    while not detector_event.is_set():
+        history.append(await probe_alive(node, timeout))
+        new_status = 'down' if history.count(False) >= k else 'up'
+        if new_status != status:
+            print(f'Node with IP {node} is {new_status}')
+            status = new_status
+            monitoring_results[node] = status
+            monitoring_events.put((node, status))
+        await asyncio.sleep(interval)
+
+
+async def detect_failures(nodes, interval, timeout, suspicion):
+    await asyncio.gather(*(watch_node(node, interval, timeout, suspicion) for node in nodes))
+
+
+def start_monitoring(nodes_to_ips, interval=MONITORING_INTERVAL, timeout=MONITORING_TIMEOUT,
+                     suspicion=MONITORING_SUSPICION):
+    """
+    Watch every node from a single event loop running in a background thread
+    :param nodes_to_ips: a dictionary having as key the node id and as value its IP
+    :param interval: the number of seconds between two probes of a node
+    :param timeout: the number of seconds to wait for a probe
+    :param suspicion: the tuple (k, n), a node is down when k of its last n probes failed
+    :return: the thread running the failure detector
+    """
     print(f'Starting the monitoring process...')
-    # except KeyboardInterrupt:
-    #     event.set()
-    #     for t in threads:
-    #         t.join()
+    detector_event.clear()
+    thread = Thread(target=asyncio.run, args=(detect_failures(list(nodes_to_ips.values()), interval, timeout,
+                                                              tuple(suspicion)),), daemon=True)
+    thread.start()
+    return thread
+
+
+def stop_monitoring():
+    """Stop the failure detector"""
+    detector_event.set()
+
+
+def set_status(node, status):
+    """Write the status of a node to monitoring_results only when it changes"""
+    state = heartbeats[node]
+    if state['status'] != status:
+        print(f'Node with IP {node} is {status}')
+        state['status'] = status
+        monitoring_results[node] = status
+        monitoring_events.put((node, status))
+
+
+def record_heartbeat(beat):
+    """
+    Record a heartbeat pushed by a node and schedule the deadline of its next one
+    :param beat: a dictionary with the node IP, the sequence number and the resources that changed
+    :return: true if the node has to send all its resources again, i.e., a heartbeat was lost or the node restarted
+    """
+    node, seq = beat['node'], int(beat['seq'])
+    with heartbeat_lock:
+        state = heartbeats.setdefault(node, {'seq': 0, 'resources': {}, 'synced': False, 'status': None,
+                                             'last_seen': 0})
+        if beat.get('full'):
+            state['resources'] = dict(beat['resources'])
+            state['synced'] = True
+        else:
+            state['resources'].update(beat['resources'])
+            # a missing sequence number means a lost delta, a smaller one means the node restarted
+            if seq != state['seq'] + 1:
+                state['synced'] = False
+        state['seq'] = seq
+        state['last_seen'] = time.monotonic()
+        deadline = state['last_seen'] + heartbeat_config['interval'] * heartbeat_config['misses']
+        heapq.heappush(heartbeat_deadlines, (deadline, node, seq))
+        set_status(node, 'up')
+        return not state['synced']
+
+
+def expire_heartbeats(interval):
+    """
+    Mark a node down when its deadline passes before a newer heartbeat arrives. The thread sleeps until the earliest
+    deadline, the deadlines of the nodes that sent a newer heartbeat are skipped when they are popped.
+    :param interval: the number of seconds between two heartbeats
+    """
+    while not heartbeat_event.is_set():
+        with heartbeat_lock:
+            now = time.monotonic()
+            while heartbeat_deadlines and heartbeat_deadlines[0][0] <= now:
+                _, node, seq = heapq.heappop(heartbeat_deadlines)
+                if heartbeats[node]['seq'] == seq:
+                    set_status(node, 'down')
+            wait = heartbeat_deadlines[0][0] - now if heartbeat_deadlines else interval
+        heartbeat_event.wait(min(wait, interval))
+
+
+def start_heartbeat_monitoring(nodes_to_ips, credentials, coordinator_url, interval=HEARTBEAT_INTERVAL,
+                               misses=HEARTBEAT_MISSES):
+    """
+    Ask every node to push its heartbeats to the coordinator instead of polling the nodes
+    :param nodes_to_ips: a dictionary having as key the node id and as value its IP
+    :param credentials: the credentials used to query the nodes
+    :param coordinator_url: the URL of the heartbeat endpoint of the coordinator
+    :param interval: the number of seconds between two heartbeats
+    :param misses: the number of missed heartbeats after which a node is down
+    :return: the thread expiring the heartbeats
+    """
+    print(f'Starting the heartbeat monitoring...')
+    heartbeat_event.clear()
+    heartbeat_config.update(interval=interval, misses=misses)
+    deadline = time.monotonic() + interval * misses
+    with heartbeat_lock:
+        for node in nodes_to_ips.values():
+            heartbeats.setdefault(node, {'seq': 0, 'resources': {}, 'synced': False, 'status': None,
+                                         'last_seen': 0})
+            heapq.heappush(heartbeat_deadlines, (deadline, node, 0))
+    for node in nodes_to_ips.values():
+        try:
+            requests.post(f'{node}/start_heartbeats', json={'url': coordinator_url, 'node': node,
+                                                            'interval': interval}, auth=credentials, timeout=20)
+        except requests.exceptions.RequestException:
+            print(f'Could not start the heartbeats of node {node}')
+    thread = Thread(target=expire_heartbeats, args=(interval, ), daemon=True)
+    thread.start()
+    return thread
+
+
+def stop_heartbeat_monitoring(nodes_to_ips, credentials):
+    """Stop the heartbeats of the nodes and the thread expiring them"""
+    heartbeat_event.set()
+    for node in nodes_to_ips.values():
+        try:
+            requests.post(f'{node}/stop_heartbeats', auth=credentials, timeout=20)
+        except requests.exceptions.RequestException:
+            pass
+
+
+def heartbeat_resources():
+    """
+    :return: a dictionary where key is a node IP and value is the resources of its last heartbeats, only for the
+    nodes that are up and whose resources are complete
+    """
+    with heartbeat_lock:
+        return {node: dict(state['resources']) for node, state in heartbeats.items()
+                if state['status'] == 'up' and state['synced']}
+
+
+def wait_for_events(window, timeout=None):
+    """
+    Block until a node changes its status, then collect the changes arriving within the window
+    :param window: the number of seconds the following changes are batched with the first one
+    :param timeout: the maximum number of seconds to wait for the first change, None waits forever
+    :return: a dictionary where key is a node IP and value is its last status, empty if the timeout expired
+    """
+    events = {}
+    try:
+        node, status = monitoring_events.get(timeout=timeout)
+    except queue.Empty:
+        return events
+    events[node] = status
+    deadline = time.monotonic() + window
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            node, status = monitoring_events.get(timeout=remaining)
+        except queue.Empty:
+            break
+        events[node] = status
+    return events
+
+
+def sample_latencies(node, peer_ids, credentials, probe_count=1):
+    """
+    Ask a node for its latency to some of its peers
+    :param node: the node that measures its latencies
+    :param peer_ids: the ids of the peers to probe
+    :param credentials: the credentials used to query the nodes
+    :param probe_count: the number of probes sent to every peer
+    :return: a dictionary where key is a peer node id and value is the latency to it
+    """
+    try:
+        resp = requests.get(f'{node["ip"]}/get_latency', params={'ids': ','.join(peer_ids), 'count': probe_count},
+                            auth=credentials, timeout=20)
+        return resp.json()
+    except requests.exceptions.RequestException:
+        return {}
+
+
+def update_latencies(latency_monitor, src_id, samples):
+    """
+    Add new samples to the moving average of the latency monitor
+    :param latency_monitor: the latency monitor created by start_latency_monitoring
+    :param src_id: the id of the node that measured the samples
+    :param samples: a dictionary where key is a peer node id and value is the latency to it
+    """
+    ids = latency_monitor['store']['ids']
+    matrix = latency_monitor['store']['matrix']
+    with latency_monitor['lock']:
+        for dest_id, latency in samples.items():
+            if str(dest_id) not in ids:
+                continue
+            i, j = ids[str(src_id)], ids[str(dest_id)]
+            old = matrix[i, j]
+            matrix[i, j] = float(latency) if np.isnan(old) else \
+                LATENCY_ALPHA * float(latency) + (1 - LATENCY_ALPHA) * old
+            latency_monitor['updated'][i, j] = time.time()
+
+
+def monitor_latencies(latency_monitor, credentials, budget):
+    """
+    Probe the links continuously, every second the stalest links of the next node are probed within the budget
+    :param latency_monitor: the latency monitor created by start_latency_monitoring
+    :param credentials: the credentials used to query the nodes
+    :param budget: the number of links probed every second
+    """
+    ids = latency_monitor['store']['ids']
+    nodes = latency_monitor['nodes']
+    step = 0
+    while not latency_monitor['event'].is_set():
+        node = nodes[step % len(nodes)]
+        step += 1
+        # only the nodes reported alive by the failure monitoring are probed
+        if monitoring_results.get(node['ip']) == 'up':
+            i = ids[str(node['id'])]
+            peers = sorted((n for n in ids if n != str(node['id'])),
+                           key=lambda n: latency_monitor['updated'][i, ids[n]])[:budget]
+            update_latencies(latency_monitor, node['id'], sample_latencies(node, peers, credentials))
+        latency_monitor['event'].wait(1)
+
+
+def start_latency_monitoring(nodes, credentials, budget=LATENCY_BUDGET):
+    """
+    Measure the latencies between nodes in the background and keep their moving average
+    :param nodes: the list of nodes
+    :param credentials: the credentials used to query the nodes
+    :param budget: the number of links probed every second
+    :return: a latency monitor, i.e., a dictionary holding a latency store and the time every link was measured
+    """
+    for node in nodes:
+        try:
+            requests.post(node['ip'] + '/nodes', json=nodes, auth=credentials, timeout=20)
+        except requests.exceptions.RequestException:
+            print(f'Could not send the topology to node {node["id"]}')
+    store = create_latency_store(node['id'] for node in nodes)
+    latency_monitor = {'store': store, 'updated': np.zeros(store['matrix'].shape), 'nodes': list(nodes),
+                       'lock': Lock(), 'event': Event()}
+    Thread(target=monitor_latencies, args=(latency_monitor, credentials, budget), daemon=True).start()
+    return latency_monitor
+
+
+def stop_latency_monitoring(latency_monitor):
+    """Stop the background thread of the latency monitor"""
+    latency_monitor['event'].set()
+
+
+def cached_latency_store(latency_monitor, credentials, staleness=LATENCY_STALENESS):
+    """
+    Re-probe only the links that are older than staleness, then copy the cached latencies
+    :param latency_monitor: the latency monitor created by start_latency_monitoring
+    :param credentials: the credentials used to query the nodes
+    :param staleness: the number of seconds after which a cached latency is measured again
+    :return: a latency store with the moving average of every link
+    """
+    ids = latency_monitor['store']['ids']
+    stale_before = time.time() - staleness
+    stale_links = {}
+    for node in latency_monitor['nodes']:
+        if monitoring_results.get(node['ip']) != 'up':
+            continue
+        i = ids[str(node['id'])]
+        peers = [n for n in ids if n != str(node['id']) and latency_monitor['updated'][i, ids[n]] < stale_before]
+        if peers:
+            stale_links[node['id']] = (node, peers)
+    if stale_links:
+        print(f'Probing the stale latencies of {len(stale_links)} nodes...')
+        with ThreadPoolExecutor(max_workers=len(stale_links)) as executor:
+            futures = {src_id: executor.submit(sample_latencies, node, peers, credentials, 3)
+                       for src_id, (node, peers) in stale_links.items()}
+            for src_id, future in futures.items():
+                update_latencies(latency_monitor, src_id, future.result())
+    with latency_monitor['lock']:
+        return {'ids': dict(ids), 'matrix': latency_monitor['store']['matrix'].copy()}
 
 
 if __name__ == '__main__':
 
-    start_monitoring()
+    start_monitoring({})
@@ -1,14 +1,25 @@
 from flask_restful import Api
 import os
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, abort
+from werkzeug.serving import WSGIRequestHandler
 import socket
 import sys
 import psutil
 import typing
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
+from threading import Thread, Event, Lock
+import queue
+import random
+import time
 import docker
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError
+from collections import deque
+from probe import probe_all, parse_address, summarize, PROBE_MODE
+import codec
 
 
 app = Flask(__name__)
@@ -18,8 +29,66 @@ microservices_dest = {}
 microservices_ports = {}
 invocation_path = {}
 nodes_ips = {}
+# the placement solution, i.e., the nodes hosting the replicas of every microservice
+replicas = {}
 app_results = 0
 LOCALHOST = '127.0.0.1'
+# the default number of pings sent to every peer and the number of seconds to wait for each of them
+PROBE_COUNT = 3
+PROBE_DEADLINE = 2
+# the maximum number of peers probed at the same time
+PROBE_WORKERS = 32
+# the number of seconds between two heartbeats and the change of RAM/HDD bytes, CPU percents or load sent as a delta
+HEARTBEAT_INTERVAL = 1
+HEARTBEAT_BYTES_DELTA = 16 * 1024 * 1024
+HEARTBEAT_CPU_DELTA = 10
+HEARTBEAT_LOAD_DELTA = 0.5
+# the number of seconds between two samples of the resources
+SAMPLE_INTERVAL = 1
+resources_snapshot = {}
+sampler = {'thread': None, 'lock': Lock()}
+# the number of created but stopped containers kept for every prefetched image
+WARM_POOL_SIZE = 1
+docker_state = {'client': None, 'warm': {}, 'lock': Lock()}
+# the number of connections kept alive to every destination, a message waits when all of them are busy
+FORWARD_CONNECTIONS = 8
+# the number of latencies kept for every hop
+FORWARD_SAMPLES = 1000
+forward_session = requests.Session()
+forward_session.mount('http://', HTTPAdapter(pool_connections=64, pool_maxsize=FORWARD_CONNECTIONS, pool_block=True))
+forward_latencies = {}
+forward_requests = {}
+forward_lock = Lock()
+# in the async mode a message is acknowledged at once and queued, the workers forward the queued messages
+FORWARD_QUEUE_SIZE = 1000
+# the number of seconds a message waits for room in a full queue before the sender is asked to retry later
+FORWARD_ENQUEUE_TIMEOUT = 1
+# the number of times a busy destination is retried and the first backoff in seconds, doubled on every retry
+FORWARD_RETRIES = 5
+FORWARD_BACKOFF = 0.05
+# the messages sent to the same microservice are batched until batch_size messages or batch_window ms
+BATCH_SIZE = 1
+BATCH_WINDOW = 5
+# the content type preferred between nodes and the content type every next node accepted, the containers get JSON
+forwarding = {'mode': 'sync', 'workers': [], 'batch_size': BATCH_SIZE, 'batch_window': BATCH_WINDOW,
+              'flusher': None, 'codec': codec.JSON, 'peer_codecs': {}, 'balancing': 'path'}
+forward_queue = queue.Queue(maxsize=FORWARD_QUEUE_SIZE)
+# the weight of a new latency in the moving average of a replica and the number of seconds a replica that did not
+# answer is skipped
+REPLICA_ALPHA = 0.3
+REPLICA_COOLDOWN = 5
+# the moving average latency in ms, the pending messages and the end of the cooldown of every next node
+replica_stats = {}
+replica_lock = Lock()
+# the pending batches and a lock per batch keeping the order of its messages, the key is (node, microservice)
+batches = {}
+batch_locks = {}
+batch_lock = Lock()
+# wakes the flusher up when a batch gets its first message
+batch_event = Event()
+heartbeat = {'url': None, 'node': None, 'interval': HEARTBEAT_INTERVAL, 'auth': None, 'seq': 0, 'sent': {},
+             'thread': None}
+heartbeat_event = Event()
 
 
 def get_ip():
@@ -35,6 +104,14 @@ def get_ip():
     return ip
 
 
+def decode_body():
+    """Decode the body of the request with the codec of its content type, 415 lists the supported content types"""
+    content_type = (request.content_type or codec.JSON).split(';')[0].strip()
+    if content_type not in codec.available_codecs():
+        abort(Response('Unsupported Media Type', 415, {'Accept': ', '.join(codec.available_codecs())}))
+    return codec.decode(request.get_data(), content_type)
+
+
 def check_auth(username: str, password: str) -> bool:
     """Check if username and password combination is valid"""
     return username == 'user' and password == 'requestaccess'
@@ -58,44 +135,227 @@ def requires_auth(f):
     return decorated
 
 
-def find_latency(node: str):
+def find_latency(node: str, count: int = PROBE_COUNT, deadline: float = PROBE_DEADLINE):
     """
     Get the average latency of a node
     :param node: the ip address of a node
-    :return: the average latency to communicate with the node, considering 3 pings
+    :param count: the number of pings
+    :param deadline: the number of seconds to wait for each ping
+    :return: the average latency to communicate with the node, None if the node did not answer
     """
-    results = subprocess.run(['ping', '-c', '3', node], stdout=subprocess.PIPE).stdout.decode('utf-8')
-
-    return results.split('\n')[-2].split(' = ')[1].split('/')[1]
+    try:
+        results = subprocess.run(['ping', '-c', str(count), '-W', str(deadline), node], stdout=subprocess.PIPE,
+                                 timeout=count * (deadline + 1)).stdout.decode('utf-8')
+        return results.split('\n')[-2].split(' = ')[1].split('/')[1]
+    except (OSError, subprocess.TimeoutExpired, IndexError):
+        return None
+
+
+def docker_client():
+    """Create the docker client once, every request reuses it"""
+    with docker_state['lock']:
+        if docker_state['client'] is None:
+            docker_state['client'] = docker.from_env()
+        return docker_state['client']
+
+
+def fill_warm_pool(image, size):
+    """Create stopped containers of an image until the warm pool of the image holds size containers"""
+    client = docker_client()
+    while True:
+        with docker_state['lock']:
+            pool = docker_state['warm'].setdefault(image, [])
+            if len(pool) >= size:
+                return
+        container = client.containers.create(image, network_mode='host')
+        with docker_state['lock']:
+            docker_state['warm'][image].append(container)
+
+
+@app.route('/prefetch_images', methods=['POST'])
+@requires_auth
+def prefetch_images():
+    """
+    Pull the given images ahead of their deployment, warm=N also creates N stopped containers of every image
+    :return: a dictionary where key is an image and value is its pull latency in ms or the error
+    """
+    images = decode_body()
+    warm = request.args.get('warm', 0, type=int)
+    client = docker_client()
+    latencies = {}
+    for image in images:
+        start = time.perf_counter()
+        try:
+            client.images.pull(image)
+            latencies[image] = (time.perf_counter() - start) * 1000
+            if warm:
+                fill_warm_pool(image, warm)
+        except docker.errors.DockerException as e:
+            latencies[image] = str(e)
+    print(f'Prefetched the images {latencies}')
+    return jsonify(latencies)
 
 
 @app.route('/start_docker_container', methods=['POST'])
 @requires_auth
 def start_docker_container():
-    """Start all local docker containers"""
-    image, exposed_port, external_port = request.get_json()
+    """Start a container of the image, a stopped container of the warm pool is started when there is one"""
+    image, exposed_port, external_port = decode_body()
     print(f'I received the following: microservice = {image}, e_port = {external_port}, exp_port{exposed_port}')
-    client = docker.from_env()
-    container_id = client.containers.run(image, network_mode='host', detach=True)
-    print(f'The container {container_id} is running!!!!')
+    start = time.perf_counter()
+    with docker_state['lock']:
+        pool = docker_state['warm'].get(image)
+        container = pool.pop() if pool else None
+    warm = container is not None
+    if warm:
+        container.start()
+        # the next move of this microservice starts warm as well
+        Thread(target=fill_warm_pool, args=(image, len(pool) + 1), daemon=True).start()
+    else:
+        container = docker_client().containers.run(image, network_mode='host', detach=True)
+    latency = (time.perf_counter() - start) * 1000
+    print(f'The container {container.id} is running after {latency:.1f} ms!!!!')
+    return jsonify({'container': container.id, 'warm': warm, 'latency': latency})
+
+
+def read_resources(cpu_interval=None):
+    """
+    :param cpu_interval: the number of seconds the CPU usage is measured, None compares to the previous call
+    :return: a dictionary with the available resources of the node
+    """
+    return {'RAM': psutil.virtual_memory().available,
+            'HDD': psutil.disk_usage('/').free,
+            'CPU': psutil.cpu_percent(interval=cpu_interval, percpu=True),
+            'CPU_cores': psutil.cpu_count(),
+            'CPU_logical_cores': psutil.cpu_count(logical=False),
+            'load': os.getloadavg(),
+            'IP': get_ip()}
+
+
+def sample_resources():
+    """Keep a snapshot of the resources, the CPU usage of every core is averaged over the sampling interval"""
+    global resources_snapshot
+
+    psutil.cpu_percent(percpu=True)
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        with sampler['lock']:
+            resources_snapshot = dict(read_resources(), time=time.time())
+
+
+def start_sampler():
+    """Start the sampling thread once"""
+    with sampler['lock']:
+        if sampler['thread'] is None:
+            sampler['thread'] = Thread(target=sample_resources, daemon=True)
+            sampler['thread'].start()
+
+
+def current_resources(max_age=None):
+    """
+    :param max_age: the maximum age in seconds of the returned resources, None accepts any snapshot
+    :return: the snapshot of the resources, sampled again if it is older than max_age
+    """
+    global resources_snapshot
+
+    start_sampler()
+    snapshot = resources_snapshot
+    if not snapshot or (max_age is not None and time.time() - snapshot['time'] > max_age):
+        with sampler['lock']:
+            # the CPU usage is measured since the previous sample, the request is not blocked
+            resources_snapshot = snapshot = dict(read_resources(), time=time.time())
+    return snapshot
+
+
+def resource_delta(resources, sent):
+    """
+    :param resources: the current resources of the node
+    :param sent: the resources known by the coordinator
+    :return: the resources that changed enough since they were last sent
+    """
+    delta = {}
+    for key, value in resources.items():
+        old = sent.get(key)
+        if old is None:
+            delta[key] = value
+        elif key in ('RAM', 'HDD'):
+            if abs(value - old) >= HEARTBEAT_BYTES_DELTA:
+                delta[key] = value
+        elif key in ('CPU', 'load'):
+            threshold = HEARTBEAT_CPU_DELTA if key == 'CPU' else HEARTBEAT_LOAD_DELTA
+            if len(value) != len(old) or any(abs(v - o) >= threshold for v, o in zip(value, old)):
+                delta[key] = value
+        elif value != old:
+            delta[key] = value
+    return delta
+
+
+def send_heartbeats():
+    """
+    Push a heartbeat to the coordinator every interval. A heartbeat carries a sequence number and only the resources
+    that changed since the previous one, all resources are sent again when the coordinator asks for a resync.
+    """
+    session = requests.Session()
+    while not heartbeat_event.is_set():
+        resources = {key: value for key, value in current_resources().items() if key != 'time'}
+        full = not heartbeat['sent']
+        delta = resources if full else resource_delta(resources, heartbeat['sent'])
+        heartbeat['seq'] += 1
+        beat = {'node': heartbeat['node'], 'seq': heartbeat['seq'], 'full': full, 'resources': delta}
+        try:
+            resp = session.post(heartbeat['url'], json=beat, auth=heartbeat['auth'], timeout=heartbeat['interval'])
+            if resp.json().get('resync'):
+                heartbeat['sent'] = {}
+            else:
+                heartbeat['sent'].update(delta)
+        except (requests.exceptions.RequestException, ValueError):
+            # the coordinator may have lost this heartbeat, the next one carries every resource
+            heartbeat['sent'] = {}
+        heartbeat_event.wait(heartbeat['interval'])
+
+
+@app.route('/start_heartbeats', methods=['POST'])
+@requires_auth
+def start_heartbeats():
+    """Start pushing heartbeats to the coordinator, the same credentials are used to authenticate them"""
+    config = decode_body()
+    heartbeat['url'] = config['url']
+    heartbeat['node'] = config['node']
+    heartbeat['interval'] = float(config.get('interval', HEARTBEAT_INTERVAL))
+    heartbeat['auth'] = (request.authorization.username, request.authorization.password)
+    heartbeat['sent'] = {}
+    print(f'Sending heartbeats to {heartbeat["url"]} every {heartbeat["interval"]} s')
+    if heartbeat['thread'] is None or not heartbeat['thread'].is_alive():
+        heartbeat_event.clear()
+        heartbeat['thread'] = Thread(target=send_heartbeats, daemon=True)
+        heartbeat['thread'].start()
+    return 'ok'
+
+
+@app.route('/stop_heartbeats', methods=['POST'])
+@requires_auth
+def stop_heartbeats():
+    """Stop pushing heartbeats to the coordinator"""
+    heartbeat_event.set()
     return 'ok'
 
 
 @app.route('/get_resources', methods=['GET'])
 @requires_auth
 def get_resources():
-    """Get the node's available resources"""
-    print(f'Getting nodes available resources...')
-
-    res = {'RAM': psutil.virtual_memory().available,
-           'HDD': psutil.disk_usage('/').free,
-           'CPU': psutil.cpu_percent(interval=1, percpu=True),
-           'CPU_cores': psutil.cpu_count(),
-           'CPU_logical_cores': psutil.cpu_count(logical=False),
-           'IP': get_ip()}
-
-    print(f'Done.')
-    print(f'Sending nodes available resources and latency...')
+    """
+    Get the node's available resources from the last snapshot. The max_age argument gives the maximum age in seconds
+    of the snapshot, and the metrics argument a comma separated list of the metrics to return, e.g., RAM,HDD,CPU.
+    The age of the snapshot is returned as well.
+    """
+    max_age = request.args.get('max_age', None, type=float)
+    metrics = request.args.get('metrics')
+    snapshot = current_resources(max_age)
+
+    res = {key: value for key, value in snapshot.items() if key != 'time'}
+    if metrics:
+        res = {key: value for key, value in res.items() if key in metrics.split(',')}
+    res['age'] = time.time() - snapshot['time']
     return jsonify(res)
 
 
@@ -105,7 +365,7 @@ def nodes_recv():
     """Receive all nodes that are part of the network"""
     global nodes
 
-    nodes = request.get_json()
+    nodes = decode_body()
     print(f'the received nodes are: {nodes}')
     return 'ok'
 
@@ -116,7 +376,7 @@ def microservices_recv():
     """Receive all app's microservices"""
     global microservices_dest
 
-    microservices_dest = request.get_json()
+    microservices_dest = decode_body()
     print(f'the received microservices are: {microservices_dest}')
     return 'ok'
 
@@ -127,7 +387,7 @@ def ips_recv():
     """Receive a dictionary with nodes IDs and IPs"""
     global nodes_ips
 
-    nodes_ips = request.get_json()
+    nodes_ips = decode_body()
     print(f'the received nodes IPs are: {nodes_ips}')
     return 'ok'
 
@@ -138,7 +398,7 @@ def ports_recv():
     """Receive the current application's invocation path"""
     global microservices_ports
 
-    microservices_ports = request.get_json()
+    microservices_ports = decode_body()
     print(f'the received ports is: {microservices_ports}')
     return 'ok'
 
@@ -149,62 +409,385 @@ def invocation_recv():
     """Receive the current application's invocation path"""
     global invocation_path
 
-    invocation_path = request.get_json()
+    invocation_path = decode_body()
     print(f'the received invocation_path is: {invocation_path}')
     return 'ok'
 
 
+@app.route('/replicas', methods=['POST'])
+@requires_auth
+def replicas_recv():
+    """Receive the placement solution, the messages are balanced between the live replicas of a microservice"""
+    global replicas
+
+    replicas = decode_body()
+    print(f'the received replicas are: {replicas}')
+    return 'ok'
+
+
 @app.route('/get_latency', methods=['GET'])
 @requires_auth
 def get_latency():
-    """Compute the latency for every node in the network"""
-    latency_dict = {}
+    """
+    Compute the latency for every node in the network, or only for the node ids given in the ids argument. The mode
+    argument selects the probe: 'tcp' connect time, 'http' round trip time or 'icmp' ping, while detail=1 returns
+    the min/avg/p99 latencies instead of the average.
+    """
+    count = request.args.get('count', PROBE_COUNT, type=int)
+    deadline = request.args.get('deadline', PROBE_DEADLINE, type=float)
+    mode = request.args.get('mode', PROBE_MODE)
+    detail = request.args.get('detail', 0, type=int)
+    peer_ids = request.args.get('ids')
     print(f'Start finding the communication latency to all nodes in the network...')
     print(f'the nodes are: {nodes}')
 
+    peers = {}
     for node in nodes:
-        print(f'Getting the latency of node: {node["id"]} with id = {node["ip"]}')
-        _, ip, port = node['ip'].split(':')
-        ip = ip.replace('//', '')
-        latency_dict[node['id']] = find_latency(ip)
+        if peer_ids and str(node['id']) not in peer_ids.split(','):
+            continue
+        peers[node['id']] = parse_address(node['ip'])
+    if mode == 'icmp':
+        with ThreadPoolExecutor(max_workers=min(PROBE_WORKERS, len(peers)) or 1) as executor:
+            futures = {node_id: executor.submit(find_latency, host, count, deadline)
+                       for node_id, (host, _) in peers.items()}
+            latency_dict = {node_id: future.result() for node_id, future in futures.items()}
+    else:
+        stats = probe_all(peers, mode, count, deadline)
+        latency_dict = {node_id: (summary if detail else summary['avg']) if summary else None
+                        for node_id, summary in stats.items()}
 
-    return jsonify(latency_dict)
+    # the peers that did not answer are left out, the coordinator treats them as missing links
+    return jsonify({node_id: latency for node_id, latency in latency_dict.items() if latency is not None})
 
 
-@app.route('/listening_containers', methods=['POST'])
-def listening():
+@app.route('/codecs', methods=['GET'])
+def codecs():
+    """Get the content types this node decodes, the preferred ones first"""
+    return jsonify(codec.available_codecs())
+
+
+@app.route('/ping', methods=['GET'])
+def ping():
+    """Answer the HTTP latency probes of the other nodes"""
+    return 'ok'
+
+
+def replica_sent(node):
+    """Count a message sent to a next node until it answers"""
+    with replica_lock:
+        stats = replica_stats.setdefault(node, {'latency': None, 'pending': 0, 'down_until': 0})
+        stats['pending'] += 1
+
+
+def replica_done(node, latency):
+    """
+    Add the latency of an answered message to the moving average of the next node
+    :param latency: the latency in ms, None if the node did not answer and is skipped for REPLICA_COOLDOWN seconds
+    """
+    with replica_lock:
+        stats = replica_stats[node]
+        stats['pending'] -= 1
+        if latency is None:
+            stats['down_until'] = time.monotonic() + REPLICA_COOLDOWN
+        else:
+            stats['latency'] = latency if stats['latency'] is None else \
+                REPLICA_ALPHA * latency + (1 - REPLICA_ALPHA) * stats['latency']
+            stats['down_until'] = 0
+
+
+def replica_score(node):
+    """:return: the expected latency of a message sent now to the node, 0 if it was never measured"""
+    stats = replica_stats.get(node)
+    if stats is None or stats['latency'] is None:
+        return 0
+    return stats['latency'] * (stats['pending'] + 1)
+
+
+def choose_replica(image_microservice, dest_microservice, tried=()):
+    """
+    Choose the node receiving the next message of a microservice. The 'path' balancing follows the invocation path,
+    'p2c' takes the better of two random live replicas and 'least-latency' the best live replica. The results of the
+    last microservice are always sent along the invocation path, where the coordinator collects them.
+    :param image_microservice: the image of the microservice, e.g., cosminava/m2
+    :param dest_microservice: the id of the microservice, e.g., m2
+    :param tried: the nodes that did not answer this message
+    :return: the id of the node, None if every replica was tried
+    """
+    path_node = invocation_path.get(image_microservice)
+    if forwarding['balancing'] == 'path' or not microservices_dest.get(dest_microservice):
+        return path_node if path_node not in tried else None
+    now = time.monotonic()
+    with replica_lock:
+        live = [n for n in replicas.get(image_microservice, []) if n in nodes_ips and n not in tried and
+                replica_stats.get(n, {}).get('down_until', 0) <= now]
+        if not live:
+            return path_node if path_node not in tried else None
+        if forwarding['balancing'] == 'p2c' and len(live) > 2:
+            live = random.sample(live, 2)
+        return min(live, key=replica_score)
+
+
+def stale_connection(hop, error):
+    """
+    :param hop: the name of the hop, e.g., node:2
+    :param error: the ConnectionError raised while posting a message
+    :return: true if the peer closed a connection kept alive since an earlier message before any byte of the answer,
+    the message did not reach the peer and can be sent again on a new connection. A connection that could not be opened
+    or timed out, or an answer cut short, is not retried as the message may have been delivered
+    """
+    reason = error.args[0] if error.args else None
+    with forward_lock:
+        reused = forward_requests.get(hop, 0) > 0
+    return reused and isinstance(reason, ProtocolError) and \
+        isinstance(reason.args[-1], (ConnectionResetError, BrokenPipeError))
+
+
+def forward(hop, url, payload, timeout, headers=None):
+    """
+    Post a message through the pooled session and record the latency of the hop
+    :param hop: the name of the hop, e.g., node:2 or container:m3
+    :param url: the URL the message is posted to
+    :param payload: the message, encoded with the preferred codec for the nodes and with JSON for the containers
+    :param timeout: the number of seconds to wait for the answer
+    :param headers: the extra headers of the request
+    :return: the response, an HTTPError is raised when the destination answered with an error, e.g., it stayed busy
+    """
+    node = hop.split(':', 1)[1] if hop.startswith('node:') else None
+    content_type = forwarding['peer_codecs'].get(hop, forwarding['codec']) if node else codec.JSON
+    if node:
+        replica_sent(node)
+    start = time.perf_counter()
+    try:
+        for retry in range(FORWARD_RETRIES + 1):
+            try:
+                resp, content_type = codec.post(forward_session, url, payload, content_type, timeout=timeout,
+                                                headers=headers)
+            except requests.exceptions.ConnectionError as e:
+                if not stale_connection(hop, e):
+                    raise
+                # the peer closed an idle pooled connection, the message is sent again on a new one
+                resp, content_type = codec.post(forward_session, url, payload, content_type, timeout=timeout,
+                                                headers=headers)
+            # the queue of an async destination is full, slow down instead of dropping the message
+            if resp.status_code != 503 or retry == FORWARD_RETRIES:
+                break
+            time.sleep(FORWARD_BACKOFF * 2 ** retry)
+        # a destination that stayed busy did not take the message, the caller reports it
+        resp.raise_for_status()
+    except requests.exceptions.RequestException:
+        if node:
+            replica_done(node, None)
+        raise
+    latency = (time.perf_counter() - start) * 1000
+    if node:
+        replica_done(node, latency)
+    # the next messages use the content type the next node accepted
+    forwarding['peer_codecs'][hop] = content_type
+    with forward_lock:
+        forward_latencies.setdefault(hop, deque(maxlen=FORWARD_SAMPLES)).append(latency)
+        forward_requests[hop] = forward_requests.get(hop, 0) + 1
+    return resp
+
+
+@app.route('/forward_stats', methods=['GET'])
+@requires_auth
+def forward_stats():
+    """Get the number of requests and the min/avg/p99 latency in ms of the last requests of every forwarding hop"""
+    with forward_lock:
+        samples = {hop: list(latencies) for hop, latencies in forward_latencies.items()}
+        counts = dict(forward_requests)
+    return jsonify({hop: dict(summarize(latencies), count=counts[hop]) for hop, latencies in samples.items()})
+
+
+def send_to_destination(container_id, recv_msg):
+    """Forward the output of a local container to the node hosting the dependent microservice"""
     global app_results
-    """Receive the output of local containers and forward it to destination nodes"""
-    print(f'I am in the listening_containers !!!!!')
-    container_id, recv_msg = request.get_json()
-    print(f'Received the message {recv_msg} from {container_id}')
+
     if container_id != 'last':
         dest_microservice = microservices_dest[container_id][0]
         print(f'Sending message to dependent microservice: {dest_microservice}')
         image_microservice = f'cosminava/{dest_microservice}'
-        node = invocation_path[image_microservice]
-        print(f'Sending message to target node ip: {nodes_ips[node]}/forward_msgs')
-        resp = requests.post(f'{nodes_ips[node]}/forward_msgs', json=(dest_microservice, recv_msg), timeout=20)
+        tried = []
+        while True:
+            node = choose_replica(image_microservice, dest_microservice, tried)
+            print(f'Sending message to target node ip: {nodes_ips[node]}/forward_msgs')
+            if forwarding['batch_size'] > 1:
+                add_to_batch(node, dest_microservice, recv_msg)
+                break
+            try:
+                resp = forward(f'node:{node}', f'{nodes_ips[node]}/forward_msgs', (dest_microservice, recv_msg), 20)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                # the message is sent to another replica as long as one is left
+                tried.append(node)
+                if choose_replica(image_microservice, dest_microservice, tried) is None:
+                    raise
     else:
         print(f'The app has finished!!')
         app_results = recv_msg
         print(f'Finally got the results: {app_results}')
+
+
+def send_to_container(container_id, recv_msg):
+    """Forward a message to the local container"""
+    print(f'Send the message to local container')
+    port, _ = microservices_ports[f'cosminava/{container_id}']
+    print(f'the path is http://{LOCALHOST}:{port}/{container_id}')
+    resp = forward(f'container:{container_id}', f'http://{LOCALHOST}:{port}/{container_id}', recv_msg, 2000)
+
+
+def send_batch(key, full=False):
+    """
+    Send the pending messages of a batch as one framed payload, i.e., the microservice and the list of messages. If
+    the node does not take the batch, its messages are handed to another replica of the microservice, or put back to
+    be sent again once the node is out of its cooldown.
+    :param key: the tuple (node, microservice) of the batch
+    :param full: if it is true then the batch is only sent when it holds batch_size messages
+    """
+    node, dest_microservice = key
+    with batch_locks[key]:
+        with batch_lock:
+            batch = batches[key]
+            if not batch['messages'] or (full and len(batch['messages']) < forwarding['batch_size']):
+                return
+            messages = batch['messages']
+            batch['messages'] = []
+        try:
+            forward(f'node:{node}', f'{nodes_ips[node]}/forward_msgs', (dest_microservice, messages), 20,
+                    {'X-Batch': str(len(messages))})
+            return
+        except requests.exceptions.RequestException as e:
+            error = e
+            replica = choose_replica(f'cosminava/{dest_microservice}', dest_microservice, [node])
+            if replica is None:
+                print(f'Could not forward the batch of {key}, it is sent again in {REPLICA_COOLDOWN} s: {e}')
+                with batch_lock:
+                    batch['messages'] = messages + batch['messages']
+                    batch['since'] = time.monotonic() + REPLICA_COOLDOWN
+                return
+    # the lock of the failed batch is released first, two batches may be handed to each other
+    print(f'Could not forward the batch of {key}, it is handed to node {replica}: {error}')
+    for recv_msg in messages:
+        add_to_batch(replica, dest_microservice, recv_msg)
+
+
+def add_to_batch(node, dest_microservice, recv_msg):
+    """Add a message to the batch of its destination, a full batch is sent by the caller"""
+    key = (node, dest_microservice)
+    with batch_lock:
+        if key not in batches:
+            batches[key] = {'messages': [], 'since': 0}
+            batch_locks[key] = Lock()
+        batch = batches[key]
+        if not batch['messages']:
+            batch['since'] = time.monotonic()
+            batch_event.set()
+        batch['messages'].append(recv_msg)
+        full = len(batch['messages']) >= forwarding['batch_size']
+    if full:
+        send_batch(key, full=True)
+
+
+def flush_batches():
+    """
+    Send the batches whose first message waits for longer than the batch window, then sleep until the window of the
+    oldest pending batch ends or a new batch starts
+    """
+    while True:
+        window = forwarding['batch_window'] / 1000
+        now = time.monotonic()
+        with batch_lock:
+            deadlines = {key: batch['since'] + window for key, batch in batches.items() if batch['messages']}
+        expired = [key for key, deadline in deadlines.items() if deadline <= now]
+        for key in expired:
+            send_batch(key)
+        if not expired:
+            batch_event.wait(min(deadlines.values()) - now if deadlines else None)
+            batch_event.clear()
+
+
+def send_batch_to_container(container_id, messages):
+    """Forward every message of a received batch to the local container"""
+    for recv_msg in messages:
+        send_to_container(container_id, recv_msg)
+
+
+def forward_worker():
+    """Forward the queued messages, a failed message is reported and dropped"""
+    while True:
+        send, container_id, recv_msg = forward_queue.get()
+        try:
+            send(container_id, recv_msg)
+        except (requests.exceptions.RequestException, KeyError) as e:
+            print(f'Could not forward the message {recv_msg} of {container_id}: {e}')
+        finally:
+            forward_queue.task_done()
+
+
+def dispatch(send, container_id, recv_msg):
+    """
+    Forward the message at once in the sync mode, otherwise queue it for the workers
+    :return: the response of the endpoint, 503 when the queue stays full
+    """
+    if forwarding['mode'] == 'sync':
+        send(container_id, recv_msg)
+        return 'ok'
+    try:
+        forward_queue.put((send, container_id, recv_msg), timeout=FORWARD_ENQUEUE_TIMEOUT)
+    except queue.Full:
+        return Response('busy', 503, {'Retry-After': '1'})
     return 'ok'
 
 
+@app.route('/forwarding_mode', methods=['POST'])
+@requires_auth
+def forwarding_mode():
+    """
+    Select the 'sync' forwarding, where a message is acknowledged once it reached the next hop, or the 'async'
+    forwarding, where a message is acknowledged once it is queued. workers gives the minimum number of forwarding
+    threads, a single worker keeps the order of the messages. batch_size and batch_window (ms) batch the messages
+    sent to the same microservice, a batch of one message disables the batching. codec is the content type
+    preferred between nodes, a node that does not support it gets the messages in a content type it accepts.
+    balancing selects how the replica of the next microservice is chosen, see choose_replica.
+    """
+    config = decode_body()
+    forwarding['mode'] = config['mode']
+    forwarding['codec'] = codec.negotiate(', '.join(codec.available_codecs()), config.get('codec', codec.JSON))
+    forwarding['peer_codecs'] = {}
+    forwarding['balancing'] = config.get('balancing', 'path')
+    forwarding['batch_size'] = int(config.get('batch_size', BATCH_SIZE))
+    forwarding['batch_window'] = float(config.get('batch_window', BATCH_WINDOW))
+    workers = int(config.get('workers', 1))
+    while len(forwarding['workers']) < workers:
+        worker = Thread(target=forward_worker, daemon=True)
+        worker.start()
+        forwarding['workers'].append(worker)
+    if forwarding['batch_size'] > 1 and forwarding['flusher'] is None:
+        forwarding['flusher'] = Thread(target=flush_batches, daemon=True)
+        forwarding['flusher'].start()
+    print(f'Forwarding mode is {forwarding["mode"]} with {len(forwarding["workers"])} workers, batches of '
+          f'{forwarding["batch_size"]} messages or {forwarding["batch_window"]} ms, encoded as {forwarding["codec"]}')
+    return 'ok'
+
+
+@app.route('/listening_containers', methods=['POST'])
+def listening():
+    """Receive the output of local containers and forward it to destination nodes"""
+    print(f'I am in the listening_containers !!!!!')
+    container_id, recv_msg = decode_body()
+    print(f'Received the message {recv_msg} from {container_id}')
+    return dispatch(send_to_destination, container_id, recv_msg)
+
+
 @app.route('/forward_msgs', methods=['POST'])
 def forward_msg():
-    global app_results
     """Forward the message to the local container"""
     print(f'I am in the forward_msgs !!!!!')
-    container_id, recv_msg = request.get_json()
+    container_id, recv_msg = decode_body()
     print(f'Sending the message {recv_msg} to {container_id}')
-    print(f'Send the message to local container')
-    port, _ = microservices_ports[f'cosminava/{container_id}']
-    print(f'the path is http://{LOCALHOST}:{port}/{container_id}')
-    resp = requests.post(f'http://{LOCALHOST}:{port}/{container_id}', json=recv_msg, timeout=2000)
-
-    return 'ok'
+    if 'X-Batch' in request.headers:
+        return dispatch(send_batch_to_container, container_id, recv_msg)
+    return dispatch(send_to_container, container_id, recv_msg)
 
 
 @app.route('/get_app_results', methods=['GET'])
@@ -220,5 +803,8 @@ if __name__ == '__main__':
     except IndexError:
         port = 5000
     print(f'I am fognode {socket.gethostname()}, with address {get_ip()}')
+    # keep the connections alive, the HTTP latency probes and the forwarded messages reuse them
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    start_sampler()
 
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
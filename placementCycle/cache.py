@@ -0,0 +1,110 @@
+from fractions import Fraction
+import hashlib
+import json
+import os
+import time
+
+
+# the maximum number of placement solutions kept on disk
+CACHE_SIZE = 32
+# resources are rounded down to buckets of 64 MB, small fluctuations of the free memory keep the same key
+RESOURCE_BUCKET = 64 * 1024 * 1024
+
+
+def placement_fingerprint(application, topology, nodes_availability, mode=''):
+    """
+    Create the key of a placement solution
+    :param application: the JSON dictionary where the model of the app is described
+    :param topology: a dictionary where the key is a node and the value represents its available resources
+    :param nodes_availability: a list of availability rate for each participant node
+    :param mode: a string describing the placement options, solutions of different modes are kept apart
+    :return: a canonical hash of the application, the node ids, their failure rates and their bucketed resources
+    """
+    fingerprint = {'application': application,
+                   'failures': sorted([str(n), float(f)] for n, f in nodes_availability),
+                   'resources': sorted([str(n)] + [int(r) // RESOURCE_BUCKET for r in resources]
+                                       for n, resources in topology.items()),
+                   'mode': mode}
+    encoded = json.dumps(fingerprint, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def load_placement_cache(file_name):
+    """
+    :param file_name: the file where the placement solutions are stored
+    :return: a dictionary where key is a fingerprint and value is a cached solution and its last use
+    """
+    try:
+        with open(file_name) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_placement_cache(file_name, cache):
+    """
+    Write the cache to a temporary file first, so that a crash never leaves a truncated cache behind
+    :param file_name: the file where the placement solutions are stored
+    :param cache: a dictionary where key is a fingerprint and value is a cached solution and its last use
+    """
+    tmp_file = f'{file_name}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_file, file_name)
+
+
+def placement_is_valid(solution, topology, app_res, availability_req, nodes_availability):
+    """
+    Check that a solution still satisfies the capacities of the nodes and the availability requirement
+    :param solution: a dictionary where key is a microservice and value is the list of nodes hosting its replicas
+    :param topology: a dictionary where the key is a node and the value represents its available resources
+    :param app_res: the microservice resource requirements given in a dictionary
+    :param availability_req: the availability requirement of the deployed application
+    :param nodes_availability: a list of availability rate for each participant node
+    :return: true if the solution can be deployed on the current topology
+    """
+    failures = dict(nodes_availability)
+    if set(solution) != set(app_res):
+        return False
+    used = {n: [0] * len(resources) for n, resources in topology.items()}
+    for m, mapping in solution.items():
+        if not mapping or any(n not in topology or n not in failures for n in mapping):
+            return False
+        for n in mapping:
+            used[n] = [u + r for u, r in zip(used[n], app_res[m])]
+        # the same objective as create_objective
+        product = Fraction(1)
+        for n in mapping:
+            product *= Fraction(float(1 - failures[n]))
+        if 1 - product < Fraction(availability_req):
+            return False
+    return all(u <= r for n, resources in topology.items() for u, r in zip(used[n], resources))
+
+
+def lookup_placement(cache, key, topology, app_res, availability_req, nodes_availability):
+    """
+    :param cache: a dictionary where key is a fingerprint and value is a cached solution and its last use
+    :param key: the fingerprint of the current application and topology
+    :return: the cached solution if it is still valid, otherwise None and the stale entry is dropped
+    """
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    if not placement_is_valid(entry['solution'], topology, app_res, availability_req, nodes_availability):
+        del cache[key]
+        return None
+    entry['last_used'] = time.time()
+    return entry['solution']
+
+
+def store_placement(cache, key, solution, max_entries=CACHE_SIZE):
+    """
+    Add a solution to the cache and evict the least recently used solutions above max_entries
+    :param cache: a dictionary where key is a fingerprint and value is a cached solution and its last use
+    :param key: the fingerprint of the current application and topology
+    :param solution: a dictionary where key is a microservice and value is the list of nodes hosting its replicas
+    :param max_entries: the maximum number of cached solutions
+    """
+    cache[key] = {'solution': solution, 'last_used': time.time()}
+    for old_key in sorted(cache, key=lambda k: cache[k]['last_used'])[:max(len(cache) - max_entries, 0)]:
+        del cache[old_key]
@@ -1,22 +1,46 @@
-from pysmt.shortcuts import Symbol, And, Plus, Int, ExactlyOne, Equals, get_formula_size, GE, Or, Not, Real
+from pysmt.shortcuts import Symbol, And, Plus, Int, ExactlyOne, Equals, get_formula_size, GE, Or, Not, Real, LE, Ite
+from pysmt.shortcuts import FALSE
 from pysmt.shortcuts import Solver
-from pysmt.typing import INT, REAL
+from pysmt.typing import INT, REAL, BOOL
+from pysmt.exceptions import SolverReturnedUnknownResultError
+from bisect import bisect_left
+from fractions import Fraction
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
 import json
+import math
+import multiprocessing
 import random
 import time
 import socket
 import requests
 from requests.auth import HTTPBasicAuth
-
-
-def check_alive(node):
+from requests.adapters import HTTPAdapter
+from placementCycle.cache import CACHE_SIZE, placement_fingerprint, load_placement_cache, save_placement_cache, \
+    lookup_placement, store_placement
+
+# the smallest availability factor used in the log-space encodings, it avoids log(0)
+MIN_FACTOR = 1e-12
+# slack added to the log-space availability bound to absorb floating point rounding of the logarithms
+LOG_TOLERANCE = 1e-9
+# the number of ms the solver has for every check of the joint placement and the maximum number of checks that
+# tighten the total number of replicas, the best placement found so far is kept once either is reached
+JOINT_TIMEOUT = 5000
+JOINT_ITERATIONS = 8
+# the number of seconds a node has to send its resources and the number of nodes queried at the same time
+RESOURCES_DEADLINE = 5
+RESOURCES_WORKERS = 32
+# the connections to the nodes are kept alive between two placements
+resources_session = requests.Session()
+resources_session.mount('http://', HTTPAdapter(pool_maxsize=RESOURCES_WORKERS))
+
+def check_alive(node, timeout=1):
     """Check if node is alive"""
     proto, host, port = node.split(':')
     host = host.replace('//', '')
     port = int(port)
-    import socket
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    result = sock.connect_ex((host, port))
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        result = sock.connect_ex((host, port))
     return result == 0
 
 
@@ -34,22 +58,56 @@ def create_nodes_pos_mappings(application, topology):
     return node_maps
 
 
-def get_topology(topology_nodes, credentials):
+def fetch_resources(node_ip, credentials, deadline):
+    """
+    :param node_ip: the address of a node
+    :param credentials: the credentials used to query the nodes
+    :param deadline: the number of seconds to wait for the connection and for the answer
+    :return: the available RAM and HDD of the node, None if it did not answer in time
+    """
+    try:
+        resp = resources_session.get(node_ip + '/get_resources', params={'metrics': 'RAM,HDD'}, auth=credentials,
+                                     timeout=deadline)
+        node_res = resp.json()
+        return [int(node_res["RAM"]), int(node_res["HDD"])]
+    except (requests.exceptions.RequestException, ValueError, KeyError):
+        return None
+
+
+def get_topology(topology_nodes, credentials, heartbeats=None, deadline=RESOURCES_DEADLINE):
     """
-    Get information regarding the topology, i.e., available resources and failure rates for each node.
+    Get information regarding the topology, i.e., available resources and failure rates for each node. The nodes are
+    queried concurrently, a node that does not answer within the deadline is left out as unavailable.
     :param topology_nodes: the list of available nodes
+    :param heartbeats: a dictionary where key is a node IP and value is the resources of its last heartbeats, the
+    other nodes are queried
+    :param deadline: the number of seconds every node has to send its resources
     :return: a dictionary where the key is a node and the value represents the resources and a list of failure rates
     for each node
     """
     node_resources = dict()
     nodes_failures = []
+    heartbeats = heartbeats or {}
+
+    queried = [node for node in topology_nodes if node["ip"] not in heartbeats]
+    workers = min(RESOURCES_WORKERS, len(queried)) or 1
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = {node["ip"]: executor.submit(fetch_resources, node["ip"], credentials, deadline) for node in queried}
+    # the queued nodes get their own deadline once a worker is free
+    wait(futures.values(), timeout=deadline * math.ceil(len(queried) / workers))
+    for future in futures.values():
+        future.cancel()
+    executor.shutdown(wait=False)
 
     for node in topology_nodes:
         node_ip = node["ip"]
-        if check_alive(node_ip):
-            resp = requests.get(node_ip + '/get_resources', auth=credentials, timeout=20)
-            node_res = resp.json()
+        if node_ip in heartbeats:
+            node_res = heartbeats[node_ip]
             node_resources[str(node["id"])] = [int(node_res["RAM"]), int(node_res["HDD"])]
+        elif futures[node_ip].done() and not futures[node_ip].cancelled() and futures[node_ip].result():
+            node_resources[str(node["id"])] = futures[node_ip].result()
+        else:
+            print(f'Node {node["id"]} did not send its resources in time, it is left out')
         nodes_failures.append((str(node["id"]), float(node['failure'])))
 
     return node_resources, nodes_failures
@@ -94,6 +152,11 @@ def availability(Rm1):
     return Symbol("Av_%s" % Rm1, REAL)
 
 
+def placed(m1, n):
+    """A macro for creating a SMT boolean symbol that is true when microservice m1 has a replica on node n"""
+    return Symbol("X%s_%s" % (m1, n), BOOL)
+
+
 def microservices_to_nodes(node_offers):
     """
     :param node_offers: a dictionary where the keys represents the nodes while the value is a list of all tasks that can
@@ -165,6 +228,24 @@ def create_objective(availabilities, app_avail):
     return GE(1 - result, Real(app_avail))
 
 
+def replication_formula(count_replicas, microservice, nodes, availability_req, nodes_availability):
+    """
+    :param count_replicas: the number of replicas of the current microservice
+    :param microservice: the current microservice we want to replicate
+    :param nodes: a dictionary where a key represents a microservice having the value a list of possible mapping nodes
+    :param availability_req: the availability requirement of the deployed application
+    :param nodes_availability: a list of availability rate for each participant node
+    :return: the formula mapping count_replicas replicas of the microservice and the list of replicas symbols
+    """
+    microservice_constraint, microservice_replicas, micro_const = create_replication(count_replicas, microservice,
+                                                                                    nodes)
+    availability_constraint, availability_obj = availability_encoding(microservice_replicas, nodes_availability)
+    problem = create_objective(availability_obj, availability_req)
+    f1 = micro_const.And(availability_constraint)
+    f2 = f1.And(microservice_constraint)
+    return f2.And(problem), microservice_replicas
+
+
 def find_replication(microservice, nodes, availability_req, nodes_availability):
     """
     :param microservice: the current microservice we want to replicate
@@ -177,13 +258,8 @@ def find_replication(microservice, nodes, availability_req, nodes_availability):
     count_replicas = 1
     solution = []
     while count_replicas <= max_no_replicas:
-        microservice_constraint, microservice_replicas, micro_const = create_replication(count_replicas, microservice,
-                                                                                        nodes)
-        availability_constraint, availability_obj = availability_encoding(microservice_replicas, nodes_availability)
-        problem = create_objective(availability_obj, availability_req)
-        f1 = micro_const.And(availability_constraint)
-        f2 = f1.And(microservice_constraint)
-        formula = f2.And(problem)
+        formula, microservice_replicas = replication_formula(count_replicas, microservice, nodes, availability_req,
+                                                             nodes_availability)
         with Solver() as solver:
             solver.add_assertion(formula)
             if solver.solve():
@@ -195,6 +271,258 @@ def find_replication(microservice, nodes, availability_req, nodes_availability):
     return solution
 
 
+def find_replication_incremental(microservice, nodes, availability_req, nodes_availability):
+    """
+    Same search as find_replication, but a single solver is kept alive for the microservice. Every iteration only
+    asserts the constraints of the newly added replica, while the replica-count objective is checked inside a
+    push/pop frame.
+    :param microservice: the current microservice we want to replicate
+    :param nodes: a dictionary where a key represents a microservice having the value a list of possible mapping nodes
+    :param availability_req: the availability requirement of the deployed application
+    :param nodes_availability: a list of availability rate for each participant node
+    :return: a strategy to map the microservice and its found replicas on the network
+    """
+    max_no_replicas = len(nodes[microservice])
+    microservice_replicas = []
+    availability_obj = []
+    solution = []
+    with Solver() as solver:
+        for i in range(max_no_replicas):
+            new_replica = replica(microservice, i)
+            solver.add_assertion(ExactlyOne(Equals(new_replica, Int(int(n))) for n in nodes[microservice]))
+            for r in microservice_replicas:
+                for n in nodes[microservice]:
+                    solver.add_assertion(Equals(r, Int(int(n))).Implies(Not(Equals(new_replica, Int(int(n))))))
+            availability_constraint, new_availability = availability_encoding([new_replica], nodes_availability)
+            solver.add_assertion(availability_constraint)
+            microservice_replicas.append(new_replica)
+            availability_obj.extend(new_availability)
+
+            solver.push()
+            solver.add_assertion(create_objective(availability_obj, availability_req))
+            if solver.solve():
+                for r in microservice_replicas:
+                    solution.append(str(solver.get_value(r)))
+                break
+            solver.pop()
+    return solution
+
+
+def minimum_replicas(microservice, nodes, availability_req, nodes_availability):
+    """
+    The objective of create_objective is monotone in the number of replicas once the candidate nodes are sorted by
+    the factor they contribute to the availability product. Hence, the minimum number of replicas is found by a
+    binary search over the prefix products.
+    :param microservice: the current microservice we want to replicate
+    :param nodes: a dictionary where a key represents a microservice having the value a list of possible mapping nodes
+    :param availability_req: the availability requirement of the deployed application
+    :param nodes_availability: a list of availability rate for each participant node
+    :return: the sorted candidate nodes and the minimum number of replicas, larger than the number of candidates if
+    the requirement cannot be reached
+    """
+    failures = dict(nodes_availability)
+    # the same exact rationals the solver sees in availability_encoding, ties keep the candidates order
+    factors = {n: Fraction(float(1 - failures[n])) for n in nodes[microservice] if n in failures}
+    candidates = sorted(factors, key=lambda n: factors[n])
+    reached = []
+    product = Fraction(1)
+    for n in candidates:
+        product *= factors[n]
+        reached.append(1 - product)
+    return candidates, bisect_left(reached, Fraction(availability_req)) + 1
+
+
+def find_replication_fast(microservice, nodes, availability_req, nodes_availability):
+    """
+    Compute the minimum number of replicas directly, the solver is only called to check the resulting mapping.
+    :param microservice: the current microservice we want to replicate
+    :param nodes: a dictionary where a key represents a microservice having the value a list of possible mapping nodes
+    :param availability_req: the availability requirement of the deployed application
+    :param nodes_availability: a list of availability rate for each participant node
+    :return: a strategy to map the microservice and its found replicas on the network
+    """
+    candidates, count_replicas = minimum_replicas(microservice, nodes, availability_req, nodes_availability)
+    if count_replicas > len(candidates):
+        return []
+    solution = candidates[:count_replicas]
+
+    formula, microservice_replicas = replication_formula(count_replicas, microservice, nodes, availability_req,
+                                                         nodes_availability)
+    mapping = And(Equals(r, Int(int(n))) for r, n in zip(microservice_replicas, solution))
+    with Solver() as solver:
+        solver.add_assertion(formula.And(mapping))
+        if solver.solve():
+            return solution
+    print(f'The closed-form mapping {solution} for microservice {microservice} was rejected by the solver')
+    return find_replication(microservice, nodes, availability_req, nodes_availability)
+
+
+def log_availability_encoding(placement_vars, nodes_availability, app_avail):
+    """
+    The objective of create_objective in log-space, i.e., the product of the availability factors of the used nodes
+    must not exceed 1 - app_avail, which turns into a linear sum over the placement variables.
+    :param placement_vars: a dictionary where key is a node and value is the placement symbol of one microservice
+    :param nodes_availability: a list of availability rate for each participant node
+    :param app_avail: the availability requirement of the deployed application
+    :return: a linear encoding of the availability objective of one microservice
+    """
+    if not placement_vars:
+        return FALSE()
+    failures = dict(nodes_availability)
+    log_factors = [Ite(x, Real(math.log(max(float(1 - failures[n]), MIN_FACTOR))), Real(0.0))
+                   for n, x in placement_vars.items()]
+    bound = math.log(max(1 - app_avail, MIN_FACTOR)) + LOG_TOLERANCE
+    return And(Or(placement_vars.values()), LE(Plus(log_factors), Real(bound)))
+
+
+def count_placements(placement_vars):
+    """
+    :param placement_vars: a list of placement symbols
+    :return: an integer term counting the placement symbols that are true
+    """
+    terms = [Ite(x, Int(1), Int(0)) for x in placement_vars]
+    return Plus(terms) if terms else Int(0)
+
+
+def pb_replication_formula(microservice, nodes, availability_req, nodes_availability):
+    """
+    A pseudo-boolean alternative to replication_formula: one boolean symbol per candidate node replaces the pairwise
+    replica constraints, while the availability objective is linear in log-space.
+    :param microservice: the current microservice we want to replicate
+    :param nodes: a dictionary where a key represents a microservice having the value a list of possible mapping nodes
+    :param availability_req: the availability requirement of the deployed application
+    :param nodes_availability: a list of availability rate for each participant node
+    :return: the formula, the placement symbols of every candidate node and the term counting the replicas
+    """
+    failures = dict(nodes_availability)
+    placement_vars = {n: placed(microservice, n) for n in nodes[microservice] if n in failures}
+    no_replicas = count_placements(placement_vars.values())
+    # the closed-form replica count is a cardinality cut, without it the solver enumerates subsets of nodes to prove
+    # that fewer replicas cannot reach the requirement
+    _, lower_bound = minimum_replicas(microservice, nodes, availability_req, nodes_availability)
+    formula = log_availability_encoding(placement_vars, nodes_availability, availability_req)
+    return formula.And(GE(no_replicas, Int(lower_bound))), placement_vars, no_replicas
+
+
+def find_replication_pb(microservice, nodes, availability_req, nodes_availability):
+    """
+    The replica search of find_replication over the pseudo-boolean encoding. The formula is asserted once and every
+    replica count is checked as a cardinality constraint inside a push/pop frame.
+    :param microservice: the current microservice we want to replicate
+    :param nodes: a dictionary where a key represents a microservice having the value a list of possible mapping nodes
+    :param availability_req: the availability requirement of the deployed application
+    :param nodes_availability: a list of availability rate for each participant node
+    :return: a strategy to map the microservice and its found replicas on the network
+    """
+    formula, placement_vars, no_replicas = pb_replication_formula(microservice, nodes, availability_req,
+                                                                  nodes_availability)
+    solution = []
+    with Solver() as solver:
+        solver.add_assertion(formula)
+        for count_replicas in range(1, len(placement_vars) + 1):
+            solver.push()
+            solver.add_assertion(LE(no_replicas, Int(count_replicas)))
+            if solver.solve():
+                solution = [n for n, x in placement_vars.items() if solver.get_value(x).is_true()]
+                break
+            solver.pop()
+    return solution
+
+
+def formula_size(encoding, microservice, nodes, count_replicas, availability_req, nodes_availability):
+    """
+    :param encoding: either 'int' for the replica symbols encoding or 'pb' for the pseudo-boolean encoding
+    :param count_replicas: the number of replicas found for the microservice
+    :return: the size of the formula that maps the microservice with the given encoding
+    """
+    if encoding == 'pb':
+        formula, _, no_replicas = pb_replication_formula(microservice, nodes, availability_req, nodes_availability)
+        return get_formula_size(formula.And(LE(no_replicas, Int(count_replicas))))
+    formula, _ = replication_formula(max(count_replicas, 1), microservice, nodes, availability_req,
+                                     nodes_availability)
+    return get_formula_size(formula)
+
+
+def find_joint_placement(microservices, nodes, topology, app_res, availability_req, nodes_availability,
+                         timeout=JOINT_TIMEOUT, iterations=JOINT_ITERATIONS):
+    """
+    Place all microservices at once. A single formula encodes every microservice, its replicas and the RAM/HDD
+    capacity of each node, then the total number of replicas is minimized by a binary search on its bound. If the
+    nodes cannot host all microservices together, or the solver cannot tell in time, the microservices are placed
+    one at a time by find_greedy_placement instead.
+    :param microservices: the list of all microservices of an application
+    :param nodes: a dictionary where a key represents a microservice having the value a list of possible mapping nodes
+    :param topology: a dictionary where the key is a node and the value represents its available resources
+    :param app_res: the microservice resource requirements given in a dictionary
+    :param availability_req: the availability requirement of the deployed application
+    :param nodes_availability: a list of availability rate for each participant node
+    :param timeout: the number of ms the solver has for every check
+    :param iterations: the maximum number of checks of the binary search
+    :return: a dictionary where key is a microservice and value is the list of nodes hosting its replicas
+    """
+    available_nodes = {m: [n for n in nodes[m] if n in topology] for m in microservices}
+    encoding = []
+    placement_vars = {}
+    replicas = []
+    for m in microservices:
+        formula, placement_vars[m], no_replicas = pb_replication_formula(m, available_nodes, availability_req,
+                                                                         nodes_availability)
+        encoding.append(formula)
+        replicas.append(no_replicas)
+    for n, resources in topology.items():
+        hosted = [(m, placement_vars[m][n]) for m in microservices if n in placement_vars[m]]
+        if not hosted:
+            continue
+        for i, available in enumerate(resources):
+            encoding.append(LE(Plus(Ite(x, Int(app_res[m][i]), Int(0)) for m, x in hosted), Int(int(available))))
+    total_replicas = Plus(replicas) if replicas else Int(0)
+    # ignoring the capacities, the closed-form replica counts give a lower bound on the total number of replicas
+    lower_bound = sum(minimum_replicas(m, available_nodes, availability_req, nodes_availability)[1]
+                      for m in microservices)
+
+    with Solver(name='z3', solver_options={'timeout': timeout}) as solver:
+        solver.add_assertion(And(encoding))
+        try:
+            placed_all = solver.solve()
+        except SolverReturnedUnknownResultError:
+            placed_all = False
+        if not placed_all:
+            print(f'The joint placement cannot place all microservices together, they are placed one at a time')
+            return find_greedy_placement(microservices, nodes, topology, app_res, availability_req,
+                                         nodes_availability, search=find_replication_fast)
+        solution = joint_solution(solver, placement_vars)
+        upper_bound = sum(len(mapping) for mapping in solution.values())
+        for _ in range(iterations):
+            if lower_bound >= upper_bound:
+                break
+            middle = (lower_bound + upper_bound) // 2
+            solver.push()
+            solver.add_assertion(LE(total_replicas, Int(middle)))
+            try:
+                if solver.solve():
+                    solution = joint_solution(solver, placement_vars)
+                    upper_bound = sum(len(mapping) for mapping in solution.values())
+                else:
+                    lower_bound = middle + 1
+            except SolverReturnedUnknownResultError:
+                print(f'The solver could not check {middle} replicas in time, the best placement found is kept')
+                break
+            finally:
+                solver.pop()
+            print(f'The total number of replicas is between {lower_bound} and {upper_bound}')
+    return solution
+
+
+def joint_solution(solver, placement_vars):
+    """
+    :param solver: a solver holding a model of the joint placement formula
+    :param placement_vars: a dictionary where key is a microservice and value is a dictionary of its placement symbols
+    :return: a dictionary where key is a microservice and value is the list of nodes hosting its replicas
+    """
+    return {m: [n for n, x in variables.items() if solver.get_value(x).is_true()]
+            for m, variables in placement_vars.items()}
+
+
 def update_topology(old_topology, micros, app_res, microservice_mapping, flag):
     """
     :param old_topology: the topology configuration before mapping the current microservice
@@ -224,7 +552,7 @@ def update_microservice_node_candidates(mapped_microservice, micro_candidates, m
         if m == mapped_microservice:
             continue
         else:
-            for n in micro_candidates[m]:
+            for n in list(micro_candidates[m]):
                 if application_res[m][0] <= topology[n][0] and\
                         application_res[m][1] <= topology[n][1]:
                     continue
@@ -237,34 +565,161 @@ def millis():
     return int(round(time.time() * 1000))
 
 
-def start_placement(nodes, credentials, application):
-    """Start to find a placement strategy that satisfies all objectives"""
-
-    topology, nodes_availability = get_topology(nodes, credentials)
-    application_resources, availability_requirement, microservices_app = get_application(application)
-    node_possible_mappings = create_nodes_pos_mappings(application,
-                                      nodes)
-
+def find_greedy_placement(microservices, nodes, topology, app_res, availability_req, nodes_availability,
+                          search=find_replication, encoding='int', report_size=False):
+    """
+    Place the microservices one at a time, after each one the topology and the candidate nodes are updated
+    :param microservices: the list of all microservices of an application
+    :param nodes: a dictionary where a key represents a microservice having the value a list of possible mapping nodes
+    :param topology: a dictionary where the key is a node and the value represents its available resources
+    :param app_res: the microservice resource requirements given in a dictionary
+    :param availability_req: the availability requirement of the deployed application
+    :param nodes_availability: a list of availability rate for each participant node
+    :param search: the function used to find the replicas of a single microservice
+    :param encoding: the encoding used by search, either 'int' or 'pb', to report the formula size
+    :param report_size: if it is true then the formula of every microservice is built again to report its size
+    :return: a dictionary where key is a microservice and value is the list of nodes hosting its replicas
+    """
     solution = {}
-    start_time = millis()
-    microservice_2_nodes = microservices_to_nodes(node_possible_mappings)
-    print(f'Start searching for a placement strategy...')
-    for m in microservices_app:
+    for m in microservices:
         # print(f'Current topology before placing {m} is: {topology}')
-        microservice_mapping = find_replication(m, microservice_2_nodes, availability_requirement, nodes_availability)
+        start_time = millis()
+        microservice_mapping = search(m, nodes, availability_req, nodes_availability)
+        solve_time = millis() - start_time
         print(f'mapping = {microservice_mapping} for microservice {m}')
+        if report_size:
+            size = formula_size(encoding, m, nodes, len(microservice_mapping), availability_req, nodes_availability)
+            print(f'search = {search.__name__}, encoding = {encoding}, formula size = {size}, '
+                  f'solve time = {solve_time} ms')
+        else:
+            print(f'search = {search.__name__}, solve time = {solve_time} ms')
         solution[m] = microservice_mapping
         if len(microservice_mapping) == 0:
             flag = True
         else:
             flag = False
-        topology = update_topology(topology, m, application_resources, microservice_mapping, flag)
-        microservice_2_nodes = update_microservice_node_candidates(m, microservice_2_nodes, microservices_app, topology,
-                                                                   application_resources)
+        topology = update_topology(topology, m, app_res, microservice_mapping, flag)
+        nodes = update_microservice_node_candidates(m, nodes, microservices, topology, app_res)
+    return solution
+
+
+def fits_on_node(microservice, node, topology, app_res):
+    """
+    :param microservice: a microservice of the application
+    :param node: a candidate node
+    :param topology: a dictionary where the key is a node and the value represents its available resources
+    :param app_res: the microservice resource requirements given in a dictionary
+    :return: true if the node is available and has enough resources left to host the microservice
+    """
+    return node in topology and all(r <= available for r, available in zip(app_res[microservice], topology[node]))
+
+
+def find_parallel_placement(microservices, nodes, topology, app_res, availability_req, nodes_availability,
+                            search=find_replication, workers=None):
+    """
+    Solve the replicas of all microservices at the same time in a process pool, each one against the nodes that can
+    host it on their own. A sequential pass then reconciles the resource conflicts, a microservice whose mapping no
+    longer fits the remaining resources is solved again against the updated candidate nodes.
+    :param microservices: the list of all microservices of an application
+    :param nodes: a dictionary where a key represents a microservice having the value a list of possible mapping nodes
+    :param topology: a dictionary where the key is a node and the value represents its available resources
+    :param app_res: the microservice resource requirements given in a dictionary
+    :param availability_req: the availability requirement of the deployed application
+    :param nodes_availability: a list of availability rate for each participant node
+    :param search: the function used to find the replicas of a single microservice
+    :param workers: the number of worker processes, None uses every core of the coordinator
+    :return: a dictionary where key is a microservice and value is the list of nodes hosting its replicas
+    """
+    candidates = {m: [n for n in nodes[m] if fits_on_node(m, n, topology, app_res)] for m in microservices}
+    # the workers are spawned, a forked worker would inherit the threads and the sockets of the coordinator
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {m: executor.submit(search, m, candidates, availability_req, nodes_availability)
+                   for m in microservices}
+        mappings = {m: future.result() for m, future in futures.items()}
+
+    solution = {}
+    for m in microservices:
+        microservice_mapping = mappings[m]
+        if not all(fits_on_node(m, n, topology, app_res) for n in microservice_mapping):
+            print(f'mapping = {microservice_mapping} for microservice {m} conflicts with the placed microservices')
+            candidates[m] = [n for n in candidates[m] if fits_on_node(m, n, topology, app_res)]
+            microservice_mapping = search(m, candidates, availability_req, nodes_availability)
+        print(f'mapping = {microservice_mapping} for microservice {m}')
+        solution[m] = microservice_mapping
+        topology = update_topology(topology, m, app_res, microservice_mapping, len(microservice_mapping) == 0)
+    return solution
+
+
+def start_placement(nodes, credentials, application, incremental=False, fast_path=False, joint=False,
+                    encoding='int', cache_file=None, cache_size=CACHE_SIZE, workers=1, heartbeats=None,
+                    report_size=False):
+    """
+    Start to find a placement strategy that satisfies all objectives
+    :param nodes: the list of available nodes
+    :param credentials: the credentials used to query the nodes
+    :param application: the JSON dictionary where the model of the app is described
+    :param incremental: if it is true then a single solver is reused while searching for the number of replicas
+    :param fast_path: if it is true then the number of replicas is computed directly and only checked by the solver
+    :param joint: if it is true then all microservices are placed by a single formula minimizing the total replicas
+    :param encoding: 'int' to map the replicas with integer symbols or 'pb' to use a boolean symbol per candidate node
+    :param cache_file: if it is given then the placement solutions are cached in this file
+    :param cache_size: the maximum number of cached placement solutions
+    :param workers: the number of processes solving the microservices in parallel, 0 uses every core
+    :param heartbeats: the resources pushed by the nodes in their heartbeats, the other nodes are queried
+    :param report_size: if it is true then the greedy placement reports the formula size of every microservice
+    :return: a dictionary where key is a microservice and value is the list of nodes hosting its replicas
+    """
+
+    collect_time = millis()
+    topology, nodes_availability = get_topology(nodes, credentials, heartbeats)
+    print(f'resource collection time = {millis() - collect_time} ms')
+    application_resources, availability_requirement, microservices_app = get_application(application)
+    node_possible_mappings = create_nodes_pos_mappings(application,
+                                      nodes)
+
+    if cache_file:
+        cache = load_placement_cache(cache_file)
+        mode = f'joint={joint},encoding={encoding},fast_path={fast_path},incremental={incremental}'
+        key = placement_fingerprint(application, topology, nodes_availability, mode)
+        solution = lookup_placement(cache, key, topology, application_resources, availability_requirement,
+                                    nodes_availability)
+        if solution is not None:
+            print(f'Reusing the cached placement strategy {solution}')
+            save_placement_cache(cache_file, cache)
+            return solution
+
+    start_time = millis()
+    # the nodes that did not send their resources in time are not candidates of any microservice
+    microservice_2_nodes = microservices_to_nodes({n: offers for n, offers in node_possible_mappings.items()
+                                                   if n in topology})
+    print(f'Start searching for a placement strategy...')
+    if joint:
+        solution = find_joint_placement(microservices_app, microservice_2_nodes, topology, application_resources,
+                                        availability_requirement, nodes_availability)
+    else:
+        if encoding == 'pb':
+            search = find_replication_pb
+        elif fast_path:
+            search = find_replication_fast
+        elif incremental:
+            search = find_replication_incremental
+        else:
+            search = find_replication
+        if workers != 1:
+            solution = find_parallel_placement(microservices_app, microservice_2_nodes, topology,
+                                               application_resources, availability_requirement, nodes_availability,
+                                               search, workers or None)
+        else:
+            solution = find_greedy_placement(microservices_app, microservice_2_nodes, topology,
+                                             application_resources, availability_requirement, nodes_availability,
+                                             search, encoding, report_size)
 
-    print(f'time = {str(millis() - start_time)} ms')
+    print(f'solve time = {str(millis() - start_time)} ms')
     print(f'Solution:')
     for s in solution:
         print(f'{s} = {solution[s]}')
+    if cache_file and all(solution.values()):
+        store_placement(cache, key, solution, cache_size)
+        save_placement_cache(cache_file, cache)
     return solution
 
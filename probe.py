@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+
+# the default probe mode, i.e., the TCP connect time or the round trip time of an HTTP request
+PROBE_MODE = 'tcp'
+# the path answered by every node_api for HTTP probes
+PING_PATH = '/ping'
+# the maximum number of peers probed at the same time
+PROBE_CONCURRENCY = 64
+
+
+def parse_address(node_ip: str, default_port: int = 80):
+    """
+    :param node_ip: the address of a node, e.g., http://127.0.0.1:5000 or 127.0.0.1
+    :param default_port: the port used when the address has none
+    :return: the host and the port of the node
+    """
+    address = node_ip.split('//')[-1].split('/')[0]
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return address, default_port
+
+
+async def tcp_samples(host: str, port: int, count: int, timeout: float):
+    """
+    :return: the TCP connect times to the peer in ms, one connection per probe
+    """
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        samples.append((time.perf_counter() - start) * 1000)
+        writer.close()
+    return samples
+
+
+async def http_samples(host: str, port: int, count: int, timeout: float):
+    """
+    :return: the round trip times in ms of HTTP requests sent to the peer over a single keep-alive connection
+    """
+    samples = []
+    request = f'GET {PING_PATH} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: keep-alive\r\n\r\n'.encode()
+    writer = None
+    try:
+        for _ in range(count):
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            headers = (await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)).decode('latin-1').lower()
+            length = 0
+            for line in headers.split('\r\n'):
+                if line.startswith('content-length:'):
+                    length = int(line.split(':')[1])
+            await asyncio.wait_for(reader.readexactly(length), timeout)
+            samples.append((time.perf_counter() - start) * 1000)
+            # a server that does not keep the connection alive costs a new connection per probe
+            if 'connection: close' in headers or headers.startswith('http/1.0'):
+                writer.close()
+                writer = None
+    finally:
+        if writer is not None:
+            writer.close()
+    return samples
+
+
+def summarize(samples):
+    """
+    :param samples: a list of latencies in ms
+    :return: a dictionary with the minimum, the average and the 99th percentile of the samples
+    """
+    ordered = sorted(samples)
+    p99 = ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+    return {'min': ordered[0], 'avg': sum(ordered) / len(ordered), 'p99': p99}
+
+
+async def probe_peers(peers, mode=PROBE_MODE, count=3, timeout=2.0, concurrency=PROBE_CONCURRENCY):
+    """
+    Probe many peers concurrently in the current event loop
+    :param peers: a dictionary where key is a peer id and value is its (host, port)
+    :param mode: 'tcp' for the TCP connect time or 'http' for the round trip time of an HTTP request
+    :param count: the number of probes sent to every peer
+    :param timeout: the number of seconds to wait for each probe
+    :param concurrency: the maximum number of peers probed at the same time
+    :return: a dictionary where key is a peer id and value is the summary of its latencies, None if it did not answer
+    """
+    sampler = http_samples if mode == 'http' else tcp_samples
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe(host, port):
+        async with semaphore:
+            try:
+                return summarize(await sampler(host, port, count, timeout))
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                return None
+
+    results = await asyncio.gather(*(probe(host, port) for host, port in peers.values()))
+    return dict(zip(peers, results))
+
+
+def probe_all(peers, mode=PROBE_MODE, count=3, timeout=2.0, concurrency=PROBE_CONCURRENCY):
+    """Run probe_peers in a new event loop, see probe_peers"""
+    return asyncio.run(probe_peers(peers, mode, count, timeout, concurrency))